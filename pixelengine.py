@@ -0,0 +1,1280 @@
+'''
+GUI-free pixelation engine. Everything in here works on PIL images and NumPy arrays only, so it can be
+imported without tkinter or matplotlib (e.g., from worker processes or a headless batch run).
+
+The pipeline is load --> trim --> enhance (sharpness, contrast) --> resample --> palette tree --> quantize.
+'''
+
+import os
+import glob
+import struct
+import zlib
+from collections import OrderedDict, namedtuple
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from dataclasses import dataclass, replace
+from functools import lru_cache
+
+import numpy as np
+from PIL import Image, ImageDraw, ImageEnhance
+
+
+#all of the knobs that determine a pixelated result. MainPage builds one of these from its widgets.
+#trim_box is (left, top, right, bottom) in PIL coordinates (origin is TOP LEFT of the image)
+@dataclass(frozen=True)
+class PixelParams:
+    npx: int = 50
+    ncolor: int = None               #None --> skip quantization (blank N Colors textbox)
+    sharpness: float = 1.0
+    contrast: float = 1.0
+    trim_mode: str = None            #None, 'auto', or 'manual'
+    trim_threshold: float = 1.0      #only used for trim_mode='auto'
+    trim_box: tuple = None           #only used for trim_mode='manual'
+    resample_mode: str = 'nearest'   #one of RESAMPLE_MODES
+
+
+#LRU cache of decoded RGBA arrays, keyed by (path, mtime, size) so that an edited file is re-read.
+#the budget is in bytes; least-recently-used entries are evicted once the total exceeds it. it only
+#bounds this cache -- the image a Pipeline is currently working on stays in memory either way (see
+#Pipeline), even one too large to be cached at all.
+class ImageCache:
+
+    def __init__(self, max_bytes=512*1024**2):
+        self.max_bytes = int(max_bytes)
+        self.entries = OrderedDict()
+        self.nbytes = 0
+
+    @staticmethod
+    def key(filepath):
+        stat = os.stat(filepath)
+        return (os.path.abspath(filepath), stat.st_mtime_ns, stat.st_size)
+
+    def get(self, key):
+        try:
+            self.entries.move_to_end(key)
+        except KeyError:
+            return None
+        return self.entries[key]
+
+    def put(self, key, img_array):
+        if key in self.entries:
+            self.nbytes -= self.entries.pop(key).nbytes
+        #an array larger than the whole budget is never cached (it would evict everything else)
+        if img_array.nbytes > self.max_bytes:
+            return
+        img_array.setflags(write=False)
+        self.entries[key] = img_array
+        self.nbytes += img_array.nbytes
+        self.evict()
+
+    def evict(self):
+        while self.nbytes > self.max_bytes and self.entries:
+            _, old = self.entries.popitem(last=False)
+            self.nbytes -= old.nbytes
+
+    def set_budget(self, max_bytes):
+        self.max_bytes = int(max_bytes)
+        self.evict()
+
+    def clear(self):
+        self.entries.clear()
+        self.nbytes = 0
+
+
+image_cache = ImageCache()
+
+
+#decoded RGBA array for filepath, re-using image_cache when the file is unchanged on disk
+def load_array(filepath, cache=image_cache):
+    if cache is None:
+        return np.asarray(Image.open(filepath).convert('RGBA'))
+
+    key = cache.key(filepath)
+    img_array = cache.get(key)
+    if img_array is None:
+        img_array = np.asarray(Image.open(filepath).convert('RGBA'))
+        cache.put(key, img_array)
+    return img_array
+
+
+def load_image(filepath, cache=image_cache):
+    return Image.fromarray(load_array(filepath, cache), 'RGBA')
+
+
+#(width, height) from the file header alone, without decoding the pixels
+def image_size(filepath):
+    with Image.open(filepath) as img:
+        return img.size
+
+
+#n_unique --> number of distinct colors, dominant --> most common color (tuple of channel values),
+#colors/counts --> full histogram, colors has shape (n_unique, channels) (or (n_unique,) for 2D images)
+ColorStats = namedtuple('ColorStats', ['n_unique', 'dominant', 'colors', 'counts'])
+
+
+#pack every pixel of an (H, W, channels) uint8 array into a single uint32 so colors can be handled with
+#1-D operations. contiguous RGBA pixels are viewed as uint32 without a copy (a trimmed view included).
+def pack_colors(img_array):
+    if img_array.shape[2]==4 and img_array.dtype==np.uint8 and img_array.strides[1:]==(4, 1):
+        return img_array.view(np.uint32)[:,:,0]
+
+    packed = np.zeros(img_array.shape[:2], dtype=np.uint32)
+    for i in range(img_array.shape[2]):
+        packed |= img_array[:,:,i].astype(np.uint32) << np.uint32(8*i)
+    return packed
+
+
+#inverse of pack_colors --> packed.shape + (nchan,) uint8 array
+def unpack_colors(packed, nchan):
+    if nchan==4:
+        return np.ascontiguousarray(packed, dtype=np.uint32).view(np.uint8).reshape(packed.shape + (4,))
+    return np.stack([(packed >> np.uint32(8*i)) & 0xFF for i in range(nchan)], axis=-1).astype(np.uint8)
+
+
+#packing avoids np.unique(axis=0), which sorts the (H*W, 4) array row by row and is painfully slow for
+#big images
+def color_stats(img_array):
+    img_array = np.asarray(img_array)
+
+    #grayscale or binary (mode 'L' or '1') --> only 256 possible values, so bincount directly
+    if img_array.ndim==2:
+        counts = np.bincount(img_array.astype(np.uint8, copy=False).ravel(), minlength=256)
+        colors = np.flatnonzero(counts)
+        counts = counts[colors]
+        colors = colors.astype(img_array.dtype)
+        return ColorStats(len(colors), colors[counts.argmax()], colors, counts)
+
+    values, counts = np.unique(pack_colors(img_array).ravel(), return_counts=True)
+    colors = unpack_colors(values, img_array.shape[2])
+
+    #break ties the way np.unique(axis=0) + argmax did: lexicographically smallest (R, G, B, A) wins
+    ties = np.flatnonzero(counts==counts.max())
+    if len(ties) > 1:
+        ties = ties[np.lexsort(colors[ties].T[::-1])]
+
+    return ColorStats(len(values), tuple(colors[ties[0]]), colors, counts)
+
+
+#background color is ASSUMED to be the most common color in the image (PIL image or array)
+def background_color(img):
+    img_array = np.asarray(img)
+    try:
+        return color_stats(img_array).dominant
+    #if any steps beget errors, then claim the background color is the color of the upper left px
+    except:
+        return tuple(np.atleast_1d(img_array[0,0]))
+
+
+#boolean mask of pixels whose channel value differs from value by more than threshold, or None if no
+#pixel can. |c - value| > threshold is done as (at most) two comparisons against integer bounds, so no
+#signed copy of the channel is ever made.
+def channel_mask(channel, value, threshold):
+    step = int(np.floor(threshold))
+    hi, lo = int(value)+step, int(value)-step
+    if hi < 0 or lo > 255:
+        return np.ones(channel.shape, dtype=bool)
+
+    if hi >= 255:
+        return channel < lo if lo > 0 else None
+    if lo <= 0:
+        return channel > hi
+    return (channel > hi) | (channel < lo)
+
+
+#(left, top, right, bottom) from per-row and per-column "has content" flags, same convention as
+#Image.getbbox()
+def flags_bbox(rows, cols):
+    rows = np.flatnonzero(rows)
+    cols = np.flatnonzero(cols)
+    if len(rows)==0 or len(cols)==0:
+        return None
+    return (int(cols[0]), int(rows[0]), int(cols[-1])+1, int(rows[-1])+1)
+
+
+#mark rows/columns of img_array (H, W, channels) that contain a pixel whose largest per-channel
+#distance from bg_color is above threshold. works through the image in bands of rows (~256 kB each by
+#default) so that the temporary masks stay small and in cache.
+def content_flags(img_array, bg_color, threshold, channels=None, band=None):
+    if channels is None:
+        channels = range(img_array.shape[2])
+    if band is None:
+        band = max(1, 2**18 // max(1, img_array[0].nbytes))
+
+    rows = np.zeros(img_array.shape[0], dtype=bool)
+    cols = np.zeros(img_array.shape[1], dtype=bool)
+    for y in range(0, img_array.shape[0], band):
+        block = img_array[y:y+band]
+        mask = None
+        for i in channels:
+            chan_mask = channel_mask(block[:,:,i], bg_color[i], threshold)
+            if chan_mask is None:
+                continue
+            if mask is None:
+                mask = chan_mask
+            else:
+                mask |= chan_mask
+        if mask is None:
+            continue
+        rows[y:y+band] = mask.any(axis=1)
+        cols |= mask.any(axis=0)
+    return rows, cols
+
+
+#first row in [lo, hi) that contains content, scanning bands of rows from lo upwards (or from hi
+#downwards if reverse) and stopping at the first hit. None if there is no such row.
+def scan_rows(img_array, bg_color, threshold, channels, lo, hi, reverse=False, band=64):
+    starts = range(lo, hi, band)
+    for start in (reversed(starts) if reverse else starts):
+        rows = np.flatnonzero(content_flags(img_array[start:min(start+band, hi)], bg_color, threshold, channels)[0])
+        if len(rows):
+            return start + int(rows[-1] if reverse else rows[0])
+    return None
+
+
+#coarse-to-fine version of the full scan in auto_bbox; gives the same bbox. the coarse pass runs on a
+#strided view that keeps every factor-th row and column (no copy). any content it finds is real
+#content, so the coarse bbox lies inside the true one and the interior never has to be read at full
+#resolution. each edge is then refined by scanning only the strip between the image border and the
+#coarse bbox.
+def auto_bbox_coarse(img_array, threshold, bg_color, channels, factor=8):
+    height, width = img_array.shape[:2]
+
+    coarse = flags_bbox(*content_flags(img_array[::factor,::factor], bg_color, threshold, channels))
+    #thin features can slip between the sampled rows/columns, so nothing found --> scan everything
+    if coarse is None:
+        return flags_bbox(*content_flags(img_array, bg_color, threshold, channels))
+
+    #(full-resolution) rows/columns of the coarse bbox edges that are known to hold content
+    left, top = factor*coarse[0], factor*coarse[1]
+    right, bottom = factor*(coarse[2]-1), factor*(coarse[3]-1)
+
+    top = scan_rows(img_array, bg_color, threshold, channels, 0, top+1)
+    bottom = scan_rows(img_array, bg_color, threshold, channels, bottom, height, reverse=True)
+
+    #only rows inside the refined top/bottom can hold the left- and right-most content
+    rows = img_array[top:bottom+1]
+    left = int(np.flatnonzero(content_flags(rows[:,:left+1], bg_color, threshold, channels)[1])[0])
+    right += int(np.flatnonzero(content_flags(rows[:,right:], bg_color, threshold, channels)[1])[-1])
+
+    return (left, top, right+1, bottom+1)
+
+
+#returns the bounding box (left, top, right, bottom) of the non-background region, or None.
+#a pixel is part of the region when its largest per-channel distance from the background color is
+#above threshold. never builds a full-size background (or difference) image.
+#img can be a PIL image or an array; pass the array if you have one (np.asarray(img) is a full copy).
+#images larger than coarse_min_pixels go through the coarse-to-fine scan (same result, fewer pixels).
+def auto_bbox(img, threshold=1.0, bg_color=None, coarse_min_pixels=2**22):
+    img_array = np.asarray(img)
+    if bg_color is None:
+        bg_color = background_color(img_array)
+    if img_array.ndim==2:
+        img_array = img_array[:,:,None]
+
+    bg_color = np.atleast_1d(bg_color)
+
+    #fast path -- fully transparent background, so only the alpha channel decides what is visible
+    if img_array.shape[2]==4 and bg_color[3]==0:
+        channels = [3]
+    else:
+        channels = range(img_array.shape[2])
+
+    if img_array.shape[0]*img_array.shape[1] >= coarse_min_pixels:
+        return auto_bbox_coarse(img_array, threshold, bg_color, channels)
+    return flags_bbox(*content_flags(img_array, bg_color, threshold, channels))
+
+
+#palette images (e.g. a quantized result) are expanded first -- their index numbers are not colors
+def trim_auto(img, threshold=1.0):
+    bbox = auto_bbox(np.asarray(editable(img)), threshold)
+    if bbox:
+        return img.crop(bbox)
+    return img
+
+
+def trim_manual(img, box):
+    return img.crop(box)
+
+
+#array version of img.crop(box). a box inside the image is a view (no copy); like PIL, any part of the
+#box outside the image is filled with zeros.
+def crop_array(img_array, box):
+    left, top, right, bottom = (int(v) for v in box)
+    height, width = img_array.shape[:2]
+    if 0 <= left <= right <= width and 0 <= top <= bottom <= height:
+        return img_array[top:bottom, left:right]
+
+    cropped = np.zeros((max(0, bottom-top), max(0, right-left)) + img_array.shape[2:], dtype=img_array.dtype)
+    x0, y0 = max(left, 0), max(top, 0)
+    x1, y1 = min(right, width), min(bottom, height)
+    if x0 < x1 and y0 < y1:
+        cropped[y0-top:y1-top, x0-left:x1-left] = img_array[y0:y1, x0:x1]
+    return cropped
+
+
+#trim stage of the array pipeline; returns a view of img_array whenever it can
+def trim_array(img_array, params):
+    if params.trim_mode=='auto':
+        bbox = auto_bbox(img_array, params.trim_threshold)
+        return crop_array(img_array, bbox) if bbox else img_array
+    if params.trim_mode=='manual' and params.trim_box is not None:
+        return crop_array(img_array, params.trim_box)
+    return img_array
+
+
+#ImageEnhance and Image.reduce cannot work on palette ('P') or binary ('1') images, e.g. a quantized
+#result, and auto-trim needs actual colors --> expand those to RGBA or L first
+def editable(img):
+    if img.mode=='P':
+        return img.convert('RGBA')
+    if img.mode=='1':
+        return img.convert('L')
+    return img
+
+
+def adjust_image(img, sharpness=1.0, contrast=1.0):
+
+    if sharpness != 1. or contrast != 1.:
+        img = editable(img)
+
+    if sharpness != 1.:
+        img = ImageEnhance.Sharpness(img).enhance(sharpness)
+
+    if contrast != 1.:
+        img = ImageEnhance.Contrast(img).enhance(contrast)
+
+    return img
+
+
+#enhance stage of the array pipeline. the default sharpness/contrast pass the (possibly trimmed) array
+#straight through, so nothing is copied until resample gathers the pixels it needs.
+def enhance_array(img_array, sharpness=1.0, contrast=1.0):
+    if sharpness==1. and contrast==1.:
+        return img_array
+    return np.asarray(adjust_image(Image.fromarray(img_array), sharpness, contrast))
+
+
+#cheap low-resolution stand-in for img (integer box reduction) whose longest side is at most max_side,
+#used to preview sharpness/contrast while the sliders are moving. small images are returned as is.
+def make_proxy(img, max_side=600):
+    factor = -(-max(img.size) // max_side)     #ceil division
+    if factor <= 1:
+        return img
+    return editable(img).reduce(factor)
+
+
+#this function helps ensure that pixel cells are square- and not rectangular-shaped
+#returns (frac_h, frac_w)
+def get_scaling_fraction(shape):
+
+    #fun fact -- these are not necessarily the height and width of the image!
+    height, width = shape[0], shape[1]
+
+    if (height>width) & ((width/height)<0.99):
+        return 1, width/height
+    elif (height<width) & ((height/width)<0.99):
+        return height/width, 1
+    elif (height==width) | ((width/height)>0.99) | ((height/width)>0.99):
+        return 1, 1
+    else:
+        print("I don't know what to tell ye. Your width and/or height are not numbers.")
+        return None
+
+
+#pixelated (width, height) for a given source shape and npx
+def target_size(shape, npx):
+    frac_h, frac_w = get_scaling_fraction(shape)
+    return int(npx*frac_w), int(npx*frac_h)
+
+
+#source index of every output pixel along one axis for a nearest-neighbour resize from n_in to n_out.
+#PIL samples at (i+0.5)*scale but accumulates the position one step at a time, so a sequential cumsum
+#(rather than multiplying) is what reproduces its rounding exactly.
+def nearest_indices(n_in, n_out):
+    scale = n_in/n_out
+    steps = np.full(n_out, scale)
+    steps[0] = scale*0.5
+    return np.minimum(np.cumsum(steps).astype(np.intp), n_in-1)
+
+
+#(rows, cols) index maps from a (height, width) source to a (height, width) target, shaped to broadcast
+#against each other. cached, since every npx value re-uses the same few source shapes.
+@lru_cache(maxsize=128)
+def nearest_index_maps(src_shape, dst_shape):
+    rows = nearest_indices(src_shape[0], dst_shape[0])[:,None]
+    cols = nearest_indices(src_shape[1], dst_shape[1])[None,:]
+    rows.setflags(write=False)
+    cols.setflags(write=False)
+    return rows, cols
+
+
+#the same maps folded into one (height, width) array of flat pixel offsets, for a source whose rows
+#start row_stride pixels apart (the full image width for a trimmed view)
+@lru_cache(maxsize=128)
+def nearest_offsets(src_shape, row_stride, dst_shape):
+    rows, cols = nearest_index_maps(src_shape, dst_shape)
+    offsets = rows*row_stride + cols
+    offsets.setflags(write=False)
+    return offsets
+
+
+#nearest-neighbour resample as a single gather that only ever reads the sampled pixels (same output as
+#Image.resize(..., Image.NEAREST)). img_array can be a strided view, e.g. a trimmed region.
+def resample_array(img_array, npx):
+    #resize down to desired number of pixels for x (nx*frac_w) and y (nx*frac_h)
+    height, width = img_array.shape[:2]
+    dst_width, dst_height = target_size(img_array.shape[:2], npx)
+
+    #RGBA rows that are contiguous (full images and trimmed views alike) --> every pixel is one uint32,
+    #gathered by flat offset from a 1-D view over the rows. about 5x quicker than the (rows, cols, 4)
+    #fancy index, which moves each channel separately.
+    if (img_array.ndim==3 and img_array.shape[2]==4 and img_array.dtype==np.uint8
+            and img_array.strides[1:]==(4, 1) and height > 0):
+        row_stride = img_array.strides[0]//4
+        pixels = np.lib.stride_tricks.as_strided(img_array.view(np.uint32), shape=((height-1)*row_stride+width,),
+                                                 strides=(4,), writeable=False)
+        offsets = nearest_offsets((height, width), row_stride, (dst_height, dst_width))
+        return pixels[offsets].view(np.uint8).reshape(dst_height, dst_width, 4)
+
+    rows, cols = nearest_index_maps((height, width), (dst_height, dst_width))
+    return img_array[rows, cols]
+
+
+#how each pixelated cell gets its color: 'nearest' keeps one source pixel per cell; the others reduce the
+#whole block of source pixels under the cell to its per-channel mean, per-channel median, or most common
+#(dominant) color -- the last one keeps pixel art crisp.
+RESAMPLE_MODES = ('nearest', 'mean', 'median', 'dominant')
+
+
+#[start, start+size) source rows (or columns) under each of n_out cells. shrinking, the cell edges are
+#(i*n_in)//n_out, so every source pixel falls in exactly one cell and cells are floor or ceil of the
+#scale factor in size. enlarging (n_out > n_in), each cell is the single pixel nearest_indices picks.
+def cell_spans(n_in, n_out):
+    if n_out >= n_in:
+        return nearest_indices(n_in, n_out), np.ones(n_out, dtype=np.intp)
+    edges = (np.arange(n_out+1)*n_in)//max(1, n_out)
+    return edges[:-1], np.diff(edges)
+
+
+#reduce the source pixels under each output pixel to one value with reduce(blocks), where blocks is
+#(..., block_height*block_width). cells come in at most two heights and two widths (see cell_spans), so
+#each group of equally sized cells is gathered from a sliding-window view and reduced in one go. runs
+#over bands of output rows (~16 MB of source each) so 40 MP inputs never need a full-size temporary.
+def block_reduce(img_array, dst_shape, reduce):
+    height, width = img_array.shape[:2]
+    dst_height, dst_width = dst_shape
+    starts_y, sizes_y = cell_spans(height, dst_height)
+    starts_x, sizes_x = cell_spans(width, dst_width)
+    columns = [(size_x, np.flatnonzero(sizes_x==size_x)) for size_x in np.unique(sizes_x)]
+
+    out = np.empty(dst_shape + img_array.shape[2:], dtype=img_array.dtype)
+    row_bytes = max(1, img_array.nbytes // max(1, dst_height))
+    band = max(1, 2**24 // row_bytes)
+    for y in range(0, dst_height, band):
+        rows = np.arange(y, min(y+band, dst_height))
+        for size_y in np.unique(sizes_y[rows]):
+            group_y = rows[sizes_y[rows]==size_y]
+            for size_x, group_x in columns:
+                windows = np.lib.stride_tricks.sliding_window_view(img_array, (size_y, size_x), axis=(0, 1))
+                blocks = windows[starts_y[group_y][:,None], starts_x[group_x][None,:]]
+                out[group_y[:,None], group_x[None,:]] = reduce(blocks.reshape(blocks.shape[:-2] + (-1,)))
+    return out
+
+
+def block_mean(blocks):
+    npix = blocks.shape[-1]
+    return ((blocks.sum(axis=-1, dtype=np.uint32) + npix//2) // npix).astype(np.uint8)
+
+
+def block_median(blocks):
+    return np.rint(np.median(blocks, axis=-1)).astype(np.uint8)
+
+
+#most common value along the last axis, for every block at once: sort each block, measure how long the
+#run of equal values ending at every position is, and take the value where the longest run ends (ties go
+#to the smallest packed value)
+def block_mode(blocks):
+    ordered = np.sort(blocks, axis=-1)
+    positions = np.arange(ordered.shape[-1])
+    changes = np.ones(ordered.shape, dtype=bool)
+    changes[...,1:] = ordered[...,1:]!=ordered[...,:-1]
+    run_starts = np.maximum.accumulate(np.where(changes, positions, 0), axis=-1)
+    run_ends = (positions - run_starts).argmax(axis=-1)
+    return np.take_along_axis(ordered, run_ends[...,None], axis=-1)[...,0]
+
+
+#block-statistics version of resample_array (same output size). mode is one of RESAMPLE_MODES.
+def resample_blocks(img_array, npx, mode='mean'):
+    if mode=='nearest':
+        return resample_array(img_array, npx)
+
+    width, height = target_size(img_array.shape[:2], npx)
+    if mode=='mean':
+        return block_reduce(img_array, (height, width), block_mean)
+    if mode=='median':
+        return block_reduce(img_array, (height, width), block_median)
+    if mode=='dominant':
+        #whole colors (not channels) have to win, so each pixel is packed into one uint32 first
+        if img_array.ndim==2:
+            return block_reduce(img_array, (height, width), block_mode)
+        packed = block_reduce(pack_colors(img_array), (height, width), block_mode)
+        return unpack_colors(packed, img_array.shape[2])
+    raise ValueError(f'unknown resample mode: {mode}')
+
+
+#compact form of a quantized result: index is a uint8 (H, W) map into palette, an (n, 3) uint8 array of RGB
+#colors, and alpha is the (H, W) alpha channel (None if fully opaque). one byte per pixel instead of four,
+#and recoloring only touches the palette.
+IndexedImage = namedtuple('IndexedImage', ['index', 'palette', 'alpha'])
+
+
+def indexed_array(indexed):
+    rgb = indexed.palette[indexed.index]
+    if indexed.alpha is None:
+        return rgb
+    return np.concatenate([rgb, indexed.alpha[:,:,None]], axis=2)
+
+
+#(n, 3) RGB palette of a palette ('P') PIL image, or (n, 4) RGBA if any entry is (partly) transparent --
+#either from an RGBA palette or from the transparency a PNG's tRNS chunk was read into
+def palette_array(img):
+    palette = np.array(img.getpalette('RGBA'), dtype=np.uint8).reshape(-1, 4)
+    transparency = img.info.get('transparency')
+    if isinstance(transparency, bytes):
+        transparency = np.frombuffer(transparency, dtype=np.uint8)[:len(palette)]
+        palette[:len(transparency),3] = transparency
+    elif transparency is not None and transparency < len(palette):
+        palette[transparency,3] = 0
+    if palette[:,3].min() == 255:
+        return palette[:,:3]
+    return palette
+
+
+#IndexedImage of a palette ('P') PIL image
+def indexed_image(img):
+    palette = palette_array(img)
+    index = np.asarray(img)
+    if palette.shape[1] == 3:
+        return IndexedImage(index, palette, None)
+    return IndexedImage(index, palette[:,:3], palette[:,3][index])
+
+
+#displayable data of a PIL image: an IndexedImage for palette images, otherwise its array
+def image_data(img):
+    if img.mode=='P':
+        return indexed_image(img)
+    return np.asarray(img)
+
+
+#pipeline results are either plain arrays (not quantized) or IndexedImages
+def result_array(result):
+    if isinstance(result, IndexedImage):
+        return indexed_array(result)
+    return result
+
+
+#the alpha channel of an IndexedImage folded into its palette: (index, palette) with one RGBA palette
+#entry per (color, alpha) pair that occurs, or None if there are more than 256 of those
+def fold_alpha(indexed):
+    pairs = indexed.index.astype(np.uint16) << 8 | indexed.alpha
+    used = np.flatnonzero(np.bincount(pairs.ravel(), minlength=1 << 16))
+    if len(used) > 256:
+        return None
+    lookup = np.zeros(1 << 16, dtype=np.uint8)
+    lookup[used] = np.arange(len(used))
+    palette = np.concatenate([indexed.palette[used >> 8], (used & 255).astype(np.uint8)[:,None]], axis=1)
+    return lookup[pairs], palette
+
+
+#PIL image of a pipeline result, for display and export. indexed results become palette ('P') images,
+#which PNG stores at (at most) one byte per pixel. transparency goes into the palette (written out as a
+#tRNS chunk), unless the result has so many (color, alpha) pairs that it has to be RGBA.
+def result_image(result):
+    if not isinstance(result, IndexedImage):
+        return Image.fromarray(result)
+    if result.alpha is None:
+        img = Image.fromarray(result.index, 'P')
+        img.putpalette(result.palette.tobytes())
+        return img
+    folded = fold_alpha(result)
+    if folded is None:
+        return Image.fromarray(indexed_array(result))
+    index, palette = folded
+    img = Image.fromarray(index, 'P')
+    img.putpalette(palette.tobytes(), 'RGBA')
+    return img
+
+
+#new IndexedImage with palette entry i set to color (RGB); the index map and alpha are shared
+def recolor(indexed, i, color):
+    palette = indexed.palette.copy()
+    palette[i] = color
+    return indexed._replace(palette=palette)
+
+
+#only keep an alpha channel that actually makes something (partly) transparent
+def alpha_channel(img_array):
+    if img_array.ndim==3 and img_array.shape[2]==4 and img_array[:,:,3].min() < 255:
+        return np.ascontiguousarray(img_array[:,:,3])
+    return None
+
+
+#Otsu's threshold for a uint8 (grayscale) array, from its histogram: the gray level that best separates
+#the pixels into two classes (maximum between-class variance). follows skimage.filters.threshold_otsu
+#step by step -- down to its float32 counts -- so the thresholds are identical, without the import.
+def threshold_otsu(img_array):
+    counts = np.bincount(np.asarray(img_array, dtype=np.uint8).ravel(), minlength=256)
+    values = np.flatnonzero(counts)
+    if len(values)==1:
+        return values[0]
+
+    counts = counts[values[0]:values[-1]+1].astype(np.float32)
+    bin_centers = np.arange(values[0], values[-1]+1)
+
+    #class probabilities and means for all possible thresholds
+    weight1 = np.cumsum(counts)
+    weight2 = np.cumsum(counts[::-1])[::-1]
+    mean1 = np.cumsum(counts * bin_centers) / weight1
+    mean2 = (np.cumsum((counts * bin_centers)[::-1]) / weight2[::-1])[::-1]
+
+    variance12 = weight1[:-1] * weight2[1:] * (mean1[:-1] - mean2[1:]) ** 2
+    return bin_centers[np.argmax(variance12)]
+
+
+#black/white BINARY version of img_array, as a two-color IndexedImage
+def binarize(img_array):
+    img = Image.fromarray(img_array).convert('L')
+
+    #the otsu threshold helps to automate the process of selecting which pixels are assigned
+    #to white, and which to black.
+    otsu_threshold = threshold_otsu(np.asarray(img))
+
+    #assign black if x>threshold and 0 if x<threshold, where x is the pixel value
+    index = (np.asarray(img) > otsu_threshold).astype(np.uint8)
+    return IndexedImage(index, np.array([[0, 0, 0], [255, 255, 255]], dtype=np.uint8), None)
+
+
+#median-cut palette for img_array, built ONCE for every number of colors up to max_colors. the box
+#(group of colors) with the widest channel range is split at the pixel-weighted median of that channel,
+#one box per step, so the palette for ncolor colors is simply the boxes that exist after ncolor-1 splits.
+#every pixel is labelled with its finest box up front; coarser palettes only need a small table mapping
+#finest box --> the box it belonged to back then (boxes are numbered in the order they were created, so
+#box f came out of parents[f] < f). the alpha channel is carried through, not quantized.
+#nothing is computed until the first cut(), so an unused tree costs nothing.
+class PaletteTree:
+
+    def __init__(self, img_array, max_colors=256):
+        self.img_array = img_array
+        self.max_colors = max_colors
+        self.cuts = {}
+        self.pixel_leaf = None
+
+    def build(self):
+        img_array = self.img_array if self.img_array.ndim==3 else self.img_array[:,:,None]
+        self.nchan = min(3, img_array.shape[2])
+
+        values, inverse, counts = np.unique(pack_colors(img_array[:,:,:self.nchan]).ravel(),
+                                            return_inverse=True, return_counts=True)
+        colors = unpack_colors(values, self.nchan)
+
+        leaf = np.zeros(len(values), dtype=np.intp)
+        members = [np.arange(len(values))]
+        spans = [self.widest_channel(colors)]
+        self.parents = [-1]
+        for box in range(1, self.max_colors):
+            split = max(range(len(members)), key=lambda i: spans[i][0])
+            if spans[split][0]==0:
+                break     #every box holds a single color
+
+            channel = spans[split][1]
+            order = members[split][np.argsort(colors[members[split], channel], kind='stable')]
+            weight = np.cumsum(counts[order])
+            cut = min(max(1, int(np.searchsorted(weight, weight[-1]/2))), len(order)-1)
+
+            members[split], members_new = order[:cut], order[cut:]
+            members.append(members_new)
+            spans[split] = self.widest_channel(colors[members[split]])
+            spans.append(self.widest_channel(colors[members_new]))
+            leaf[members_new] = box
+            self.parents.append(split)
+
+        #pixel-weighted color sums and pixel counts of the finest boxes
+        nleaf = len(members)
+        self.leaf_counts = np.bincount(leaf, weights=counts, minlength=nleaf)
+        self.leaf_sums = np.stack([np.bincount(leaf, weights=counts*colors[:,i], minlength=nleaf)
+                                   for i in range(self.nchan)], axis=1)
+        self.pixel_leaf = leaf.astype(np.uint8)[inverse].reshape(img_array.shape[:2])
+
+    #(range, channel) of the channel with the widest spread of values among colors
+    @staticmethod
+    def widest_channel(colors):
+        spread = colors.max(axis=0).astype(int) - colors.min(axis=0)
+        return int(spread.max()), int(spread.argmax())
+
+    #(index map, palette) for ncolor colors: uint8 (H, W) palette indices and an (n, 3) uint8 RGB palette,
+    #with n <= ncolor (fewer if the image has fewer colors)
+    def cut(self, ncolor):
+        if self.pixel_leaf is None:
+            self.build()
+        ncolor = min(ncolor, len(self.parents))
+        if ncolor not in self.cuts:
+            table = np.arange(len(self.parents))
+            for box in range(ncolor, len(self.parents)):
+                table[box] = table[self.parents[box]]
+
+            sums = np.zeros((ncolor, self.nchan))
+            counts = np.zeros(ncolor)
+            np.add.at(sums, table, self.leaf_sums)
+            np.add.at(counts, table, self.leaf_counts)
+            palette = np.rint(sums / counts[:,None]).astype(np.uint8)
+            if self.nchan==1:
+                palette = np.repeat(palette, 3, axis=1)     #grayscale --> gray RGB colors
+            self.cuts[ncolor] = (table.astype(np.uint8)[self.pixel_leaf], palette)
+        return self.cuts[ncolor]
+
+    #IndexedImage of img_array quantized to ncolor colors (alpha as in img_array)
+    def quantize(self, ncolor):
+        index, palette = self.cut(ncolor)
+        return IndexedImage(index, palette, alpha_channel(self.img_array))
+
+
+#quantize stage of the array pipeline --> IndexedImage (img_array itself if there is nothing to do). pass
+#the PaletteTree of img_array (if there is one) to re-use it.
+def quantize_array(img_array, ncolor, tree=None):
+
+    #only 1-256 colors are supported; anything else leaves the image as is (as does a blank textbox)
+    if ncolor is None or not 1 <= ncolor <= 256:
+        return img_array
+
+    #I assume users who select ncolor=2 are wanting a black/white BINARY image!
+    if ncolor==2:
+        return binarize(img_array)
+
+    if tree is None:
+        tree = PaletteTree(img_array)
+    return tree.quantize(ncolor)
+
+
+#run every stage and return the intermediate results (arrays) keyed by stage name
+def pixelate_stages(img, params):
+    stages = {}
+    stages['trim'] = trim_array(np.asarray(img), params)
+    stages['enhance'] = enhance_array(stages['trim'], params.sharpness, params.contrast)
+    stages['resample'] = resample_blocks(stages['enhance'], params.npx, params.resample_mode)
+    stages['palette'] = PaletteTree(stages['resample'])
+    stages['quantize'] = quantize_array(stages['resample'], params.ncolor, stages['palette'])
+    return stages
+
+
+#img can be a PIL image, an array or a filepath; returns the pixelated image as a NumPy array
+def pixelate(img, params):
+    if isinstance(img, (str, os.PathLike)):
+        img = load_array(img)
+    return result_array(pixelate_stages(img, params)['quantize'])
+
+
+#one node of the pipeline graph. key(params) picks out the parameters the stage actually reads, and
+#func(upstream output, params) computes the stage.
+class Stage:
+
+    def __init__(self, name, func, key, upstream=None):
+        self.name = name
+        self.func = func
+        self.key = key
+        self.upstream = upstream
+
+
+def trim_key(params):
+    if params.trim_mode=='auto':
+        return ('auto', params.trim_threshold)
+    if params.trim_mode=='manual':
+        return ('manual', params.trim_box)
+    return (None,)
+
+
+#every stage passes NumPy arrays: decode hands out the (read-only) cached array, trim a view of it, and
+#resample gathers the sampled pixels straight out of that view
+STAGES = [Stage('decode', None, lambda params: ()),
+          Stage('trim', trim_array, trim_key, 'decode'),
+          Stage('enhance', lambda img, params: enhance_array(img, params.sharpness, params.contrast),
+                lambda params: (params.sharpness, params.contrast), 'trim'),
+          Stage('resample', lambda img, params: resample_blocks(img, params.npx, params.resample_mode),
+                lambda params: (params.npx, params.resample_mode), 'enhance'),
+          Stage('palette', lambda img, params: PaletteTree(img), lambda params: (), 'resample'),
+          Stage('quantize', lambda tree, params: quantize_array(tree.img_array, params.ncolor, tree),
+                lambda params: (params.ncolor,), 'palette')]
+
+
+#dirty-tracking version of pixelate_stages. every stage remembers the key it was last computed with
+#(its own parameters plus the key of its upstream stage), so a parameter change only recomputes the
+#stages downstream of it -- e.g., changing ncolor re-uses the resampled image, changing npx re-uses the
+#trimmed+enhanced image. the render step lives in the GUI and compares against keys['quantize'].
+#
+#speculate() fills a small side cache (at most side_entries outputs, least-recently-used dropped first)
+#with results for parameters that have not been asked for yet; run() takes them from there for free.
+#
+#outputs holds on to the decoded source for as long as it is the current one (trim and enhance are
+#usually views of it anyway), on top of -- and regardless of -- the image_cache budget.
+class Pipeline:
+
+    def __init__(self, stages=STAGES, cache=image_cache, side_entries=16):
+        self.stages = {stage.name: stage for stage in stages}
+        self.order = [stage.name for stage in stages]
+        self.cache = cache
+        self.keys = {}
+        self.outputs = {}
+        self.recomputed = []
+        self.side = OrderedDict()
+        self.side_entries = side_entries
+        self.image = None       #the PIL image last run on, kept alive so it is compared by identity
+        self.image_serial = 0
+
+    #the decode stage is keyed by (path, mtime, size) for files. PIL images are numbered as they come
+    #in: id() alone could be handed to a new image once the old one is garbage-collected
+    def source_key(self, source):
+        if isinstance(source, Image.Image):
+            if source is not self.image:
+                self.image = source
+                self.image_serial += 1
+            return ('image', self.image_serial)
+        return ('file',) + ImageCache.key(source)
+
+    def decode(self, source):
+        if isinstance(source, Image.Image):
+            return np.asarray(source)
+        return load_array(source, self.cache)
+
+    def run(self, source, params, until='quantize'):
+        self.recomputed = []
+        for name in self.order:
+            stage = self.stages[name]
+            if stage.upstream is None:
+                key = (self.source_key(source),)
+            else:
+                key = (self.keys[stage.upstream], stage.key(params))
+
+            if self.keys.get(name) != key:
+                if stage.upstream is None:
+                    self.outputs[name] = self.decode(source)
+                    #speculative results belong to the previous source
+                    self.side.clear()
+                elif key in self.side:
+                    self.side.move_to_end(key)
+                    self.outputs[name] = self.side[key]
+                else:
+                    self.outputs[name] = stage.func(self.outputs[stage.upstream], params)
+                self.keys[name] = key
+                self.recomputed.append(name)
+
+            if name==until:
+                break
+        return self.outputs
+
+    #compute the stages from `start` onwards for params into the side cache, starting from whatever is
+    #cached upstream of `start` right now (so call it after run() with neighbouring params). the
+    #outputs and keys that run() works with are left untouched. cancelled() (if given) is checked before
+    #each stage that has to be computed, so speculation stops as soon as real work is waiting.
+    def speculate(self, params, start='resample', cancelled=None):
+        upstream = self.stages[start].upstream
+        key, output = self.keys.get(upstream), self.outputs.get(upstream)
+        if key is None:
+            return
+
+        for name in self.order[self.order.index(start):]:
+            stage = self.stages[name]
+            key = (key, stage.key(params))
+            if self.keys.get(name)==key:
+                output = self.outputs[name]
+            elif key in self.side:
+                self.side.move_to_end(key)
+                output = self.side[key]
+            else:
+                if cancelled is not None and cancelled():
+                    return
+                output = stage.func(output, params)
+                self.side[key] = output
+                while len(self.side) > self.side_entries:
+                    self.side.popitem(last=False)
+
+    def clear(self):
+        self.keys.clear()
+        self.outputs.clear()
+        self.side.clear()
+        self.image = None
+
+
+#the parameters one +/- press away from params (N Pixels and N Colors step by exactly one). a new npx
+#means a new resample, which is only cheap for 'nearest' (the block modes reduce the full-resolution
+#image, a second or more at 24 MP), so the block modes only look ahead to N Colors.
+def neighbour_params(params):
+    neighbours = []
+    if params.resample_mode=='nearest':
+        neighbours += [replace(params, npx=npx) for npx in (params.npx+1, params.npx-1) if npx > 0]
+    if params.ncolor is not None:
+        neighbours += [replace(params, ncolor=ncolor) for ncolor in (params.ncolor+1, params.ncolor-1)
+                       if 1 <= ncolor <= 256]
+    return neighbours
+
+
+#################
+#PARAMETER SWEEPS
+#################
+
+#every (npx, ncolor) combination from one already trimmed+enhanced array. each npx value is resampled
+#(and gets its palette tree) once, shared by all of its ncolor values, and the npx values run in
+#parallel threads (NumPy releases the GIL for most of the work). returns {(npx, ncolor): pipeline result}
+def sweep(enhanced, npx_values, ncolor_values, workers=None, resample_mode='nearest'):
+
+    def sweep_npx(npx):
+        tree = PaletteTree(resample_blocks(enhanced, npx, resample_mode))
+        return {(npx, ncolor): quantize_array(tree.img_array, ncolor, tree) for ncolor in ncolor_values}
+
+    results = {}
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        for variants in pool.map(sweep_npx, npx_values):
+            results.update(variants)
+    return results
+
+
+#lay the sweep results out on one image: a column per npx, a row per ncolor, each variant blown up
+#(nearest neighbour, so the cells stay sharp) to fit a cell x cell square under a small label
+def contact_sheet(results, npx_values, ncolor_values, cell=160, pad=24):
+    sheet = Image.new('RGBA', (len(npx_values)*(cell+pad)+pad, len(ncolor_values)*(cell+2*pad)+pad),
+                      'white')
+    draw = ImageDraw.Draw(sheet)
+
+    for row, ncolor in enumerate(ncolor_values):
+        for col, npx in enumerate(npx_values):
+            variant = result_image(results[(npx, ncolor)]).convert('RGBA')
+            #integer blow-up where possible, otherwise shrink to fit
+            factor = cell // max(variant.size) if max(variant.size) <= cell else cell/max(variant.size)
+            variant = variant.resize((max(1, int(variant.width*factor)), max(1, int(variant.height*factor))),
+                                     resample=Image.NEAREST)
+
+            x = pad + col*(cell+pad)
+            y = pad + row*(cell+2*pad)
+            draw.text((x, y), f'npx={npx}, ncolor={ncolor}', fill='black')
+            sheet.alpha_composite(variant, (x, y+pad))
+    return sheet
+
+
+#################
+#RASTER EXPORT
+#################
+
+#gridlines to burn into an export, styled like the GUI's: a line on every spacing-th cell edge (offset in
+#cells, 0.5 --> on the edges), color as an (R, G, B) or (R, G, B, A) tuple of 0-255 values, thickness in
+#output pixels. every 10th line is thicker and fully opaque, the others are drawn at 60% opacity.
+GridStyle = namedtuple('GridStyle', ['spacing', 'color', 'thickness', 'offset'], defaults=[1, (0, 0, 0), 1.0, 0.5])
+
+
+#(start, stop, opacity) output-pixel spans of the gridlines across ncells cells of scale pixels each.
+#like the GUI's add_grid, lines are counted from the bottom of the image (rows, from_end=True) or from
+#the left (columns).
+def grid_spans(ncells, scale, grid, from_end=False):
+    spans = []
+    for n in range(0, ncells, grid.spacing):
+        major = (n+1)%10==0
+        width = max(1, int(round(grid.thickness + (0.7 if major else 0))))
+        edge = n + grid.offset + 0.5
+        if from_end:
+            edge = ncells - edge
+        start = int(round(edge*scale - width/2))
+        start, stop = max(0, start), min(ncells*scale, start+width)
+        if start < stop:
+            spans.append((start, stop, 1.0 if major else 0.6))
+    return spans
+
+
+#grid opacity (0-255) of every output row and column, 0 where there is no line. 1-D, so cheap even for
+#a 30k-pixel-wide export.
+def grid_alphas(height, width, scale, grid):
+    opacity = grid.color[3]/255. if len(grid.color) > 3 else 1.
+    alphas = []
+    for ncells, from_end in ((height, True), (width, False)):
+        alpha = np.zeros(ncells*scale, dtype=np.uint16)
+        for start, stop, line_alpha in grid_spans(ncells, scale, grid, from_end):
+            alpha[start:stop] = int(round(255*line_alpha*opacity))
+        alphas.append(alpha)
+    return alphas
+
+
+#blend color into pixels (uint8, channels last) with per-pixel-row/column opacity alpha (0-255), in
+#integer arithmetic
+def blend(pixels, color, alpha):
+    mixed = (pixels.astype(np.uint16)*(255-alpha) + color*alpha + 127)//255
+    return mixed.astype(np.uint8)
+
+
+#the integer upscale of img_array ((h, w) or (h, w, channels)) as a read-only (h, scale, w, scale, ...)
+#view -- every source pixel repeated through zero strides, so nothing is copied
+def upscale_view(img_array, scale):
+    height, width = img_array.shape[:2]
+    return np.broadcast_to(img_array[:,None,:,None], (height, scale, width, scale) + img_array.shape[2:])
+
+
+#the output rows of source rows [first, last) of the scale-times upscaled img_array, written into out (a
+#((last-first)*scale, w*scale, ...) array, allocated if not given) straight from the broadcast view -- no
+#full-size intermediate. gridlines (img_array must then be RGB(A)) are blended into just the rows and
+#columns they cover. flip mirrors the result (source and grid alike) without a transpose of the output.
+#alphas --> grid_alphas(), if already computed.
+def upscale_rows(img_array, scale, first, last, grid=None, flip=False, out=None, alphas=None):
+    height, width = img_array.shape[:2]
+    if flip:
+        img_array = img_array[:,::-1]
+    if out is None:
+        out = np.empty(((last-first)*scale, width*scale) + img_array.shape[2:], dtype=img_array.dtype)
+
+    np.copyto(out.reshape((last-first, scale, width, scale) + img_array.shape[2:]),
+              upscale_view(img_array[first:last], scale))
+
+    if grid is not None:
+        row_alpha, col_alpha = grid_alphas(height, width, scale, grid) if alphas is None else alphas
+        row_alpha = row_alpha[first*scale:last*scale]
+        if flip:
+            col_alpha = col_alpha[::-1]
+        color = np.array(tuple(grid.color[:3]) + (255,)*(img_array.shape[2]-3), dtype=np.uint16)
+
+        lines = np.flatnonzero(row_alpha)
+        out[lines] = blend(out[lines], color, row_alpha[lines][:,None,None])
+        cols = np.flatnonzero(col_alpha)
+        out[:,cols] = blend(out[:,cols], color, col_alpha[cols][None,:,None])
+    return out
+
+
+#the whole scale-times upscale of img_array, filled band by band (~16 MB of output rows at a time) into
+#the one output array, so a 10k x 10k export needs the output and one band of blending temporaries
+def upscale_array(img_array, scale, grid=None, flip=False):
+    height, width = img_array.shape[:2]
+    out = np.empty((height*scale, width*scale) + img_array.shape[2:], dtype=img_array.dtype)
+    alphas = None if grid is None else grid_alphas(height, width, scale, grid)
+
+    band = max(1, 2**24 // max(1, scale*out[0].nbytes))     #source rows per band
+    for first in range(0, height, band):
+        last = min(first+band, height)
+        upscale_rows(img_array, scale, first, last, grid, flip, out=out[first*scale:last*scale], alphas=alphas)
+    return out
+
+
+#what an export is made of: the (small) array to upscale and, for palette images without a grid, the
+#(n, 3) or (n, 4) palette its values index into (None otherwise, see palette_array)
+def export_source(img, grid=None):
+    if grid is None and img.mode=='P':
+        return np.asarray(img), palette_array(img)
+    if grid is not None:
+        img = img.convert('RGBA')
+    elif img.mode=='1':
+        img = img.convert('L')
+    elif img.mode not in ('L', 'RGB', 'RGBA'):
+        img = img.convert('RGBA')
+    return np.asarray(img), None
+
+
+#the image itself, pixel for pixel (no axes, ticks or title): blown up by an integer scale (so every cell
+#is an exact scale x scale square), with the grid burned in if one is given and mirrored if flip (the
+#grid too, as Flip X-Axis mirrors the gridded view). a palette image without a grid stays a palette
+#image, upscaled as its one-byte index map.
+def export_image(img, scale=1, grid=None, flip=False):
+    img_array, palette = export_source(img, grid)
+    upscaled = upscale_array(img_array, max(1, int(scale)), grid, flip)
+    if palette is None:
+        return Image.fromarray(upscaled)
+    exported = Image.fromarray(upscaled, 'P')
+    exported.putpalette(palette.tobytes(), 'RGBA' if palette.shape[1]==4 else 'RGB')
+    return exported
+
+
+#PNG color type for (array channels, palette or not)
+PNG_COLOR_TYPES = {(1, True): 3, (1, False): 0, (3, False): 2, (4, False): 6}
+
+
+#PNG encoder settings. compress_level is zlib's 0-9 (higher --> smaller files, slower saves); optimize
+#makes the encoder try harder still (smallest files, slowest saves)
+PngOptions = namedtuple('PngOptions', ['compress_level', 'optimize'], defaults=(6, False))
+
+
+def save_png(img, path, png=PngOptions()):
+    img.save(path, compress_level=png.compress_level, optimize=png.optimize)
+    return path
+
+
+def png_chunk(kind, data):
+    return struct.pack('>I', len(data)) + kind + data + struct.pack('>I', zlib.crc32(kind + data))
+
+
+#bits per index for an ncolors palette -- as Pillow does, small palettes pack 2, 4 or 8 pixels per byte
+def palette_bits(ncolors):
+    for bits in (1, 2, 4):
+        if ncolors <= 1 << bits:
+            return bits
+    return 8
+
+
+#(rows, width) index map --> (rows, ceil(width*bits/8)) bytes, leftmost pixel in the high bits
+def pack_indices(rows, bits):
+    if bits == 8:
+        return rows
+    per_byte = 8 // bits
+    pad = -rows.shape[1] % per_byte
+    if pad:
+        rows = np.pad(rows, ((0, 0), (0, pad)))
+    groups = rows.reshape(rows.shape[0], -1, per_byte)
+    shifts = np.arange(8-bits, -1, -bits, dtype=np.uint8)
+    return np.bitwise_or.reduce(groups << shifts, axis=2)
+
+
+#same output as export_image(...).save(path), but streamed: the upscaled rows are generated one band
+#at a time (~band_bytes of output each) and compressed straight into the file's IDAT chunks, so peak
+#memory is one band no matter how large the print is (a 30k x 30k RGBA export would be 3.6 GB in one
+#piece). every row uses PNG's "Up" filter -- within a cell each row repeats the one above it, which
+#then compresses to next to nothing. palettes are written as PLTE (+ tRNS if they carry alpha), with the
+#index map packed to 1, 2 or 4 bits per pixel when the palette is small enough.
+def save_upscaled_png(path, img, scale=1, grid=None, flip=False, png=PngOptions(), band_bytes=2**24):
+    img_array, palette = export_source(img, grid)
+    scale = max(1, int(scale))
+    height, width = img_array.shape[:2]
+    nchan = 1 if img_array.ndim==2 else img_array.shape[2]
+    bits = 8 if palette is None else palette_bits(len(palette))
+    alphas = None if grid is None else grid_alphas(height, width, scale, grid)
+
+    compressor = zlib.compressobj(9 if png.optimize else png.compress_level)
+    previous = np.zeros(-(-width*scale*nchan*bits // 8), dtype=np.uint8)
+    band = max(1, band_bytes // max(1, scale*scale*width*nchan))     #source rows per band
+
+    with open(path, 'wb') as f:
+        f.write(b'\x89PNG\r\n\x1a\n')
+        f.write(png_chunk(b'IHDR', struct.pack('>IIBBBBB', width*scale, height*scale, bits,
+                                               PNG_COLOR_TYPES[(nchan, palette is not None)], 0, 0, 0)))
+        if palette is not None:
+            f.write(png_chunk(b'PLTE', palette[:,:3].tobytes()))
+            if palette.shape[1] == 4:
+                #alpha of every entry up to the last transparent one (the rest default to opaque)
+                last_transparent = np.flatnonzero(palette[:,3] < 255)[-1]
+                f.write(png_chunk(b'tRNS', palette[:last_transparent+1,3].tobytes()))
+
+        for first in range(0, height, band):
+            last = min(first+band, height)
+            rows = upscale_rows(img_array, scale, first, last, grid, flip, alphas=alphas)
+            rows = pack_indices(rows.reshape(rows.shape[0], -1), bits)
+
+            #filter type byte (2 = Up) + each row minus the row above it (mod 256)
+            filtered = np.empty((rows.shape[0], rows.shape[1]+1), dtype=np.uint8)
+            filtered[:,0] = 2
+            filtered[0,1:] = rows[0] - previous
+            filtered[1:,1:] = rows[1:] - rows[:-1]
+            previous = rows[-1].copy()
+
+            data = compressor.compress(filtered)
+            if data:
+                f.write(png_chunk(b'IDAT', data))
+
+        f.write(png_chunk(b'IDAT', compressor.flush()))
+        f.write(png_chunk(b'IEND', b''))
+    return path
+
+
+#################
+#BATCH (HEADLESS) PIXELATION
+#################
+
+#same file types the GUI's Browse dialog offers
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png')
+
+
+#pattern can be a directory (every image inside it) or a glob pattern
+def find_images(pattern):
+    if os.path.isdir(pattern):
+        pattern = os.path.join(pattern, '*')
+    return sorted(path for path in glob.glob(pattern) if path.lower().endswith(IMAGE_EXTENSIONS))
+
+
+#output filenames are {prefix}{counter}{suffix}, e.g. save_path+'cat' + '3' + '-pxd.png'. each directory is
+#listed once (os.scandir) and its file names kept in memory, so finding the next free counter costs no
+#disk access however many earlier outputs there are. a name is reserved by creating it (empty) with
+#O_EXCL, so separate processes saving into the same directory never hand out the same name.
+class FilenameAllocator:
+
+    def __init__(self):
+        self.names = {}       #directory --> set of file names in it
+        self.counters = {}    #(prefix, suffix) --> lowest counter that may still be free
+        self.reserved = {}    #path --> ((prefix, suffix), counter), see release()
+
+    def listing(self, directory):
+        if directory not in self.names:
+            try:
+                with os.scandir(directory or '.') as entries:
+                    self.names[directory] = {entry.name for entry in entries}
+            except FileNotFoundError:
+                self.names[directory] = set()
+        return self.names[directory]
+
+    #first free {prefix}{counter}{suffix} path with counter >= start, created empty before it is returned
+    def reserve(self, prefix, suffix, start=0):
+        directory, stem = os.path.split(prefix)
+        names = self.listing(directory)
+        counter = max(start, self.counters.get((prefix, suffix), 0))
+        while True:
+            name = '{}{:d}{}'.format(stem, counter, suffix)
+            counter += 1
+            if name in names:
+                continue
+            names.add(name)
+            path = os.path.join(directory, name)
+            try:
+                os.close(os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY, 0o666))
+            except FileExistsError:
+                continue      #created after the directory was listed (by another process)
+            self.counters[(prefix, suffix)] = counter
+            self.reserved[path] = ((prefix, suffix), counter-1)
+            return path
+
+    #a reserved path whose save failed or never happened: remove the (empty or partly written) file and
+    #hand its counter out again
+    def release(self, path):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        directory, name = os.path.split(path)
+        self.listing(directory).discard(name)
+        if path in self.reserved:
+            key, counter = self.reserved.pop(path)
+            self.counters[key] = min(self.counters.get(key, counter), counter)
+
+
+filename_allocator = FilenameAllocator()
+
+
+#output filenames follow the GUI's save_image: {save_path}{filename}{counter}-pxd.png, reserved
+#through filename_allocator
+def output_path(path, save_path):
+    return filename_allocator.reserve(save_path + os.path.basename(path).split('.')[0], '-pxd.png')
+
+
+#runs in the worker processes. the decode cache is skipped (each file is read exactly once). the output
+#name is only reserved (through the worker's own filename_allocator -- O_EXCL keeps the workers apart)
+#once the result is ready to be written, so even a killed run leaves at most one file per worker behind.
+def pixelate_file(path, save_path, params, png=PngOptions()):
+    img = result_image(pixelate_stages(load_array(path, cache=None), params)['quantize'])
+    out = output_path(path, save_path)
+    try:
+        return save_png(img, out, png)
+    except Exception:
+        filename_allocator.release(out)
+        raise
+
+
+#pixelate every file in paths into save_path with a pool of worker processes (workers=None --> one
+#per CPU). yields (input path, output path or the exception raised) as each file finishes. stopping
+#early (Ctrl-C, the caller breaking out) cancels whatever has not started yet.
+def batch_pixelate(paths, save_path, params, workers=None, png=PngOptions()):
+    os.makedirs(save_path, exist_ok=True)
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        try:
+            futures = {pool.submit(pixelate_file, path, save_path, params, png): path for path in paths}
+            for future in as_completed(futures):
+                try:
+                    yield futures[future], future.result()
+                except Exception as err:
+                    yield futures[future], err
+        finally:
+            pool.shutdown(cancel_futures=True)
@@ -4,29 +4,55 @@ https://stackoverflow.com/questions/7546050/switch-between-two-frames-in-tkinter
 '''
 
 import sys 
+import time
 
-import tkinter as tk
-import numpy as np
-import os
-from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
+#(phase, time.perf_counter()) as each startup phase finishes, reported by --profile-startup
+startup_marks = [('launch', time.perf_counter())]
+def mark_startup(phase):
+    startup_marks.append((phase, time.perf_counter()))
 
-from matplotlib import figure              #see self.fig, self.ax.
-
-import matplotlib                          #I need this for matplotlib.use. sowwee.
-matplotlib.use('TkAgg')                    #strange error messages will appear otherwise.
+from concurrent.futures import ThreadPoolExecutor
+import os
 
+import tkinter as tk
 from tkinter import font as tkFont
 from tkinter import messagebox
 from tkinter import filedialog
-import glob
+mark_startup('import tkinter')
 
-import matplotlib.ticker as ticker
-from PIL import Image, ImageChops, ImageEnhance
+import numpy as np
+mark_startup('import numpy')
+
+import pixelengine
+mark_startup('import pixelengine')
+
+#matplotlib is by far the slowest import and only the GUI draws anything, so it is imported on first use
+#(the batch mode and --help never load it). load_matplotlib() binds these names; App calls it.
+matplotlib = figure = ticker = FigureCanvasTkAgg = LineCollection = to_rgba = ListedColormap = None
 
-from skimage.filters import threshold_otsu
+def load_matplotlib():
+    global matplotlib, figure, ticker, FigureCanvasTkAgg, LineCollection, to_rgba, ListedColormap
+    if matplotlib is not None:
+        return
+    
+    import matplotlib                          #I need this for matplotlib.use. sowwee.
+    matplotlib.use('TkAgg')                    #strange error messages will appear otherwise.
+    mark_startup('import matplotlib')
+    
+    from matplotlib import figure              #see self.fig, self.ax.
+    import matplotlib.ticker as ticker
+    from matplotlib.collections import LineCollection
+    from matplotlib.colors import to_rgba, ListedColormap
+    mark_startup('import matplotlib.figure')
+    
+    from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
+    mark_startup('import matplotlib TkAgg backend')
 
 homedir = os.getenv('HOME')
 
+#how saved PNGs are encoded (png_compress_level and png_optimize in params.txt)
+png_options = pixelengine.PngOptions()
+
 #create main window container, into which the first page will be placed.
 class App(tk.Tk):
     
@@ -34,7 +60,10 @@ class App(tk.Tk):
     def __init__(self, path_to_repos, initial_browsedir, save_path, window_geometry, init_offset,
                 popup_geometry): 
 
+        load_matplotlib()
+        
         super().__init__()   #initialize tkinter window
+        mark_startup('create Tk window')
         
         self.title('Project Pixel: Generate Pixelated Images for Art')
         self.geometry(window_geometry)
@@ -77,6 +106,8 @@ class MainPage(tk.Frame):
         
         self.init_offset = float(init_offset)
         self.color = 'black'    #for gridlines
+        self.gridlines = None   #LineCollection holding every gridline, see add_grid()
+        self.indexed = None     #palette form of the current image, if it has one (see set_img_array)
         
         self.popup_geometry=popup_geometry
         
@@ -87,6 +118,25 @@ class MainPage(tk.Frame):
                 
         self.savefig_counter = 0     #will use for filenames! 
         
+        #cached decode --> trim --> enhance --> resample --> palette --> quantize stages; see pixelengine.Pipeline
+        self.pipeline = pixelengine.Pipeline()
+        self.rendered_key = None     #pipeline key of the result currently drawn on the canvas
+        self.result_img = None       #self.img_only while it is the pixelated result shown as is (see save_image)
+        
+        #pending (debounced) sharpness/contrast update, see schedule_adjust()
+        self.adjust_job = None
+        self.adjust_first = 0.
+        
+        #heavy lifting (decode, trim, enhance, pixelate) happens on this thread; see submit_job()
+        self.worker = ThreadPoolExecutor(max_workers=1)
+        self.job_gen = 0             #bumped for every new job; results from older generations are dropped
+        self.job_future = None
+        self.spec_futures = []       #speculative neighbour results queued on the worker, see speculate()
+        
+        #display-sized copy of self.img_only for slider previews, see get_proxy()
+        self.proxy = None
+        self.proxy_source = None
+        
         #first frame...initialize inside of the parent (App window)
         super().__init__(parent)
         
@@ -117,16 +167,36 @@ class MainPage(tk.Frame):
         #(All functions are defined below this section.)
         ##############
         self.im_to_display()   #creates browse frame
+        mark_startup('build browse frame')
         self.init_display_size()   #creates canvas frame
+        mark_startup('build figure + canvas')
         self.populate_params()     #creates parameter frame
+        mark_startup('build parameter frame')
     
     #create separate popup window for image display features, intended for pre-pixelation
     def popup_params(self):
+        #already open --> bring it to the front rather than building a second copy of every widget
+        try:
+            if self.popup_frame.winfo_exists():
+                self.popup_frame.lift()
+                return
+        except AttributeError:
+            pass
         self.popup_frame = ParamWindow(self,self.popup_geometry)
         self.popup_frame.resizable(False, False) 
     
     def close_popup(self):
+        self.cancel_adjust()
         self.popup_frame.destroy()
+    
+    #separate popup window for trying out many N Pixels / N Colors combinations at once
+    def popup_sweep(self):
+        self.sweep_frame = SweepWindow(self)
+    
+    def add_sweep_button(self):
+        self.sweep_button = tk.Button(self.frame_params,text='Parameter Sweep',padx=2,pady=2,
+                                      font='Arial 16', command=self.popup_sweep)
+        self.sweep_button.grid(row=10,column=0,columnspan=4,sticky='ew')
 
     #add trimming features!
     def add_param_button(self):
@@ -160,6 +230,13 @@ class MainPage(tk.Frame):
         self.ncolor = tk.Entry(self.frame_params,width=5,borderwidth=2,bg='black',fg='lime green',font='Arial 15')
         self.ncolor.grid(row=5,column=2,rowspan=2,sticky='w')
         
+        #how each cell gets its color (see pixelengine.RESAMPLE_MODES)
+        tk.Label(self.frame_params,text='Cell Color',font='Arial 14').grid(row=7,column=0)
+        self.resample_mode = tk.StringVar(value='nearest')
+        self.resample_menu = tk.OptionMenu(self.frame_params,self.resample_mode,*pixelengine.RESAMPLE_MODES)
+        self.resample_menu.config(font='Arial 14')
+        self.resample_menu.grid(row=8,column=0)
+        
         self.pix_button_trim = tk.Button(self.frame_params,text="Pixelate", padx=4, pady=4, 
                                         font='Arial 20', command=self.resize_im)
         self.pix_button_trim.grid(row=7,column=1,rowspan=2,columnspan=3,sticky='nsew')
@@ -190,9 +267,7 @@ class MainPage(tk.Frame):
         except:
             #if the user's input in this textbox is NONETYPE, then find the number of unique colors in
             #the image array and increment from there...
-            #the following two lines are taken from self.im_trim()
-            im_px = self.img_array.reshape(-1, self.img_array.shape[2])
-            ncol_val = len(np.unique(im_px, axis=0, return_counts=False))-1
+            ncol_val = pixelengine.color_stats(self.img_array).n_unique-1
         ncol_val += 1
         self.ncolor.delete(0,tk.END)
         self.ncolor.insert(0,str(ncol_val))
@@ -205,9 +280,7 @@ class MainPage(tk.Frame):
         except:
             #if the user's input in this textbox is NONETYPE, then find the number of unique colors in
             #the image array and decrement from there...
-            #the following two lines are taken from self.im_trim()
-            im_px = self.img_array.reshape(-1, self.img_array.shape[2])
-            ncol_val = len(np.unique(im_px, axis=0, return_counts=False))-1
+            ncol_val = pixelengine.color_stats(self.img_array).n_unique-1
         ncol_val -= 1
         self.ncolor.delete(0,tk.END)
         self.ncolor.insert(0,str(ncol_val))
@@ -300,22 +373,76 @@ class MainPage(tk.Frame):
     
     def save_image(self):
         
-        while os.path.exists('{}{:d}-pxd.png'.format(self.save_path+self.filename, self.savefig_counter)):
-            self.savefig_counter += 1
-        filename = '{}{:d}-pxd.png'.format(self.save_path+self.filename,self.savefig_counter)
-        self.fig.savefig(filename,dpi=100,bbox_inches='tight', pad_inches=0.2)
+        if not (self.figurevar.get() or hasattr(self, 'img_only')):
+            print('Nothing to save yet -- load an image first.')
+            return
+        
+        #figure style --> the canvas as shown, axes, ticks and all. anything but a pixelated result (a photo
+        #not yet pixelated, a trim, a sharpness/contrast preview) is saved this way too -- the Export
+        #Scale is meant for cells, and would blow a full-size photo up tenfold
+        as_figure = self.figurevar.get() or self.img_only is not self.result_img
+        
+        #read the grid entries before taking a filename, so a typo there does not leave an empty file
+        settings = None if as_figure else self.export_settings()
+        filename = pixelengine.filename_allocator.reserve(self.save_path+self.filename, '-pxd.png',
+                                                          self.savefig_counter)
+        try:
+            if as_figure:
+                self.fig.savefig(filename,dpi=100,bbox_inches='tight', pad_inches=0.2)
+            else:
+                pixelengine.save_upscaled_png(filename, *settings, png=png_options)
+        except Exception:
+            pixelengine.filename_allocator.release(filename)
+            raise
         print(f'Figure saved to: {filename}')        
+    
+    #the current image written out pixel for pixel (see pixelengine.save_upscaled_png), blown up by the
+    #Export Scale and with the gridlines, x-flip and grayscale applied if those boxes are checked
+    #returns (img, scale, grid, flip)
+    def export_settings(self):
+        
+        img = self.img_only.convert('L') if self.grayvar.get() else self.img_only
+        
+        grid = None
+        if self.var.get()==1:
+            color = tuple(int(round(255*c)) for c in to_rgba(self.color_grid.get()))
+            grid = pixelengine.GridStyle(spacing=int(self.line_spacing.get()), color=color,
+                                         thickness=float(self.line_thickness.get()),
+                                         offset=float(self.offset_val.get()))
+        
+        return img, self.get_export_scale(), grid, self.flipvar.get()
+    
+    def get_export_scale(self):
+        try:
+            return max(1, int(self.export_scale.get()))
+        except:
+            return 1
             
     def add_save_button(self):
         
         self.save_button = tk.Button(self.frame_params, text='Save Result', padx=5, pady=5, font='Ariel 20',
                                      command=self.save_image)
         self.save_button.grid(row=20,column=0,columnspan=4,sticky='ew')
+        
+        #exported cells are export_scale x export_scale squares
+        export_scale_lab = tk.Label(self.frame_params,text='Export Scale',font='Arial 14')
+        export_scale_lab.grid(row=21,column=0,sticky='nsew',columnspan=2)
+        self.export_scale = tk.Entry(self.frame_params,width=5,borderwidth=2,bg='black',fg='lime green',
+                                     font='Arial 15')
+        self.export_scale.insert(0,'10')
+        self.export_scale.grid(row=21,column=2,sticky='nsew')
+        
+        #the old behavior -- save the whole figure (axes, ticks, title) rather than just the image
+        self.figurevar = tk.BooleanVar()
+        self.figurecheck = tk.Checkbutton(self.frame_params,text='Save as Figure',
+                                          onvalue=True,offvalue=False,variable=self.figurevar,font='Arial 14')
+        self.figurecheck.grid(row=22,column=0,sticky='ew',columnspan=4)
 
     def populate_params(self):
         self.add_param_button()
         self.resize_widgets()
         self.add_crement_buttons()
+        self.add_sweep_button()
         self.grid_checkbox()    
         self.grid_textbox()
         self.flip_checkbox()
@@ -330,6 +457,7 @@ class MainPage(tk.Frame):
         self.path_to_im.grid(row=0,column=0,columnspan=2)
         self.add_browse_button()
         self.add_enter_button()
+        self.add_busy_label()
 
     #add browse button to frame_buttons
     def add_browse_button(self):
@@ -343,6 +471,59 @@ class MainPage(tk.Frame):
                                  font='Arial 18', command=self.initiate_canvas)
         self.path_button.grid(row=1,column=1)
 
+    #shows 'Working...' while the worker thread is busy
+    def add_busy_label(self):
+        self.busy_lab = tk.Label(self.frame_buttons, text='', font='Arial 14', fg='red')
+        self.busy_lab.grid(row=2,column=0,columnspan=2)
+    
+    def set_busy(self, busy):
+        self.busy_lab.config(text='Working...' if busy else '')
+        self.winfo_toplevel().config(cursor='watch' if busy else '')
+    
+    #run compute() on the worker thread and hand its result to on_done() back on the Tk main loop (Tk
+    #is not thread-safe, so the main loop polls the future with after()). every new job supersedes the
+    #previous one: if that one has not started yet it is cancelled, otherwise its result is discarded.
+    def submit_job(self, compute, on_done, poll_ms=20):
+        self.cancel_jobs()
+        self.job_future = self.worker.submit(compute)
+        self.set_busy(True)
+        self.after(poll_ms, self.poll_job, self.job_future, self.job_gen, on_done, poll_ms)
+    
+    def poll_job(self, future, gen, on_done, poll_ms):
+        #superseded --> whoever superseded this job looks after the busy indicator
+        if gen != self.job_gen:
+            return
+        if not future.done():
+            self.after(poll_ms, self.poll_job, future, gen, on_done, poll_ms)
+            return
+        self.set_busy(False)
+        on_done(future.result())
+    
+    #invalidate whatever is queued or running (call before drawing anything synchronously)
+    def cancel_jobs(self):
+        self.job_gen += 1
+        if self.job_future is not None:
+            self.job_future.cancel()
+            self.job_future = None
+        #real work always beats speculation
+        for future in self.spec_futures:
+            future.cancel()
+        self.spec_futures = []
+        self.set_busy(False)
+    
+    #the +/- buttons move N Pixels / N Colors by exactly one, so once the worker is idle, precompute
+    #those neighbours into the pipeline's (bounded) side cache. the next press then finds its result
+    #ready. anything still queued is cancelled as soon as a real job is submitted, and one already
+    #running stops at its next stage (job_gen has moved on by then).
+    def speculate(self,params,gen):
+        #something else has been asked for since this was scheduled
+        if gen != self.job_gen:
+            return
+        cancelled = lambda: gen != self.job_gen
+        for neighbour in pixelengine.neighbour_params(params):
+            self.spec_futures.append(self.worker.submit(self.pipeline.speculate, neighbour,
+                                                        cancelled=cancelled))
+    
     #function for opening the file explorer window
     def browseFiles(self):
         filename = filedialog.askopenfilename(initialdir = self.initial_browsedir, 
@@ -358,30 +539,48 @@ class MainPage(tk.Frame):
         #self.fig.subplots_adjust(left=0.06, right=0.94, top=0.94, bottom=0.06)
 
         self.ax = self.fig.add_subplot()
-        self.im = self.ax.imshow(np.zeros(100).reshape(10,10),origin='lower',alpha=0)
+        #this canvas, axes and AxesImage are re-used for every image (see draw_im_canvas)
+        self.im = self.ax.imshow(np.zeros(100).reshape(10,10),origin='lower',alpha=0,cmap='gray')
         self.ax.set_title('Click "Browse" to the right to begin!',fontsize=15)
-        self.text = self.ax.text(x=2.8,y=5.0,s='Your Image',color='red',fontsize=28)
-        self.text = self.ax.text(x=2.9,y=4.1,s='Goes Here',color='red',fontsize=28)
+        self.placeholder = [self.ax.text(x=2.8,y=5.0,s='Your Image',color='red',fontsize=28),
+                            self.ax.text(x=2.9,y=4.1,s='Goes Here',color='red',fontsize=28)]
+        self.drawn_shape = None     #shape of the image currently on the canvas
+        self.axes_dirty = False     #True once the grid/flip boxes have changed limits, ticks or spines
         self.canvas = FigureCanvasTkAgg(self.fig, master=self.frame_display) 
 
         #add canvas 'frame'
         self.label = self.canvas.get_tk_widget()
         self.label.grid(row=0,column=0,columnspan=4,rowspan=6,sticky='nsew')
     
-    def load_image(self):
-        self.full_filepath = str(self.path_to_im.get())
+    #img --> an already-decoded image (e.g., from the worker thread); otherwise it is loaded here
+    def load_image(self,filepath=None,img=None):
+        self.full_filepath = str(self.path_to_im.get()) if filepath is None else filepath
 
-        self.img_only = Image.open(self.full_filepath).convert('RGBA')
-        self.img_array = np.asarray(self.img_only)
+        self.img_only = pixelengine.load_image(self.full_filepath) if img is None else img
+        self.set_img_array()
         
         #save the ORIGINAL image's width and height; will need for trimming.
         self.width_og, self.height_og = self.img_only.size
     
+    #self.img_only --> self.img_array. palette ('P') images, i.e. pixelated results, are kept as their
+    #uint8 index map (self.img_array) plus palette (self.indexed) and drawn through a colormap
+    def set_img_array(self):
+        data = pixelengine.image_data(self.img_only)
+        self.indexed = data if isinstance(data, pixelengine.IndexedImage) else None
+        self.img_array = data if self.indexed is None else data.index
+    
+    #what draw_im_canvas should show for the current image
+    def canvas_data(self):
+        return self.img_array if self.indexed is None else self.indexed
+    
     #setting up file variables
-    def img_firstpass(self):
+    def img_firstpass(self,filepath=None,img=None):
+        
+        self.load_image(filepath,img)
+        self.set_filename()
+    
+    def set_filename(self):
         
-        self.load_image()
-
         #add title...because why not?
         try:
             full_filepath = self.full_filepath.split('/')   #split full pathname into components
@@ -391,30 +590,61 @@ class MainPage(tk.Frame):
         except:
             self.filename = 'Generic'
         
-    def draw_im_canvas(self,img_array):
-
-        #delete any and all miscellany from the canvas (including that which was created
-        #using self.init_display_size())
-        self.label.delete('all')
-        self.ax.remove()
+    #data --> an array, or a pixelengine.IndexedImage (index map drawn through a colormap of its palette)
+    def set_canvas_data(self,data):
+        if isinstance(data, pixelengine.IndexedImage):
+            self.im.set_data(np.flipud(data.index))
+            self.im.set_cmap(ListedColormap(data.palette/255.))
+            self.im.set_clim(-0.5, len(data.palette)-0.5)
+            self.im.set_alpha(None if data.alpha is None else np.flipud(data.alpha)/255.)
+            #colormap first, then resample --> never blends palette indices
+            self.im.set_interpolation_stage('rgba')
+        else:
+            self.im.set_data(np.flipud(data))
+            self.im.set_cmap('gray')
+            self.im.set_alpha(None)
+            self.im.set_interpolation_stage('data')
+            if np.ndim(data)==2:
+                self.im.autoscale()     #grayscale/binary --> rescale the colormap to the new values
+    
+    #img_array can also be an IndexedImage (see set_canvas_data)
+    #shape --> (height, width) of the image that img_array depicts, if img_array is a reduced proxy
+    def draw_im_canvas(self,img_array,shape=None):
+        
+        #whatever is drawn now is not (necessarily) a pipeline result; resize_im sets this after drawing
+        self.rendered_key = None
 
-        #reset checkboxes
+        #reset checkboxes (and remove the gridlines they may have added)
         self.gridcheck.deselect()
         self.flipcheck.deselect()
         self.graycheck.deselect()
+        self.remove_grid()
         
-        self.ax = self.fig.add_subplot()
-        self.im = self.ax.imshow(np.flipud(img_array),origin='lower',cmap='gray')
+        #first image --> clear out the placeholder text created using self.init_display_size()
+        for text in self.placeholder:
+            text.remove()
+        self.placeholder = []
+        
+        #update the existing AxesImage in place rather than re-creating the axes and canvas
+        self.set_canvas_data(img_array)
         
         self.ax.set_title(f'{self.filename}',fontsize=15)
         
-        self.create_axislabels()
+        #extent, limits and ticks only change with the image shape (or after the grid/flip boxes)
+        if shape is None:
+            shape = np.shape(self.im.get_array())[:2]
+        if shape != self.drawn_shape or self.axes_dirty:
+            height, width = shape
+            self.im.set_extent((-0.5, width-0.5, -0.5, height-0.5))
+            self.ax.set_xlim(-0.5, width-0.5)
+            self.ax.set_ylim(-0.5, height-0.5)
+            for spine in self.ax.spines.values():
+                spine.set_linewidth(matplotlib.rcParams['axes.linewidth'])
+            self.create_axislabels()
+            self.drawn_shape = shape
+            self.axes_dirty = False
         
-        self.canvas = FigureCanvasTkAgg(self.fig, master=self.frame_display)    
-
-        #add canvas 'frame'
-        self.label = self.canvas.get_tk_widget()
-        self.label.grid(row=0,column=0,columnspan=3,rowspan=6)
+        self.canvas.draw_idle()
     
     #use ONLY for the enter/refresh button. first file pass!
     def initiate_canvas(self):
@@ -437,57 +667,96 @@ class MainPage(tk.Frame):
         except:
             pass
         
-        #draw fresh image
-        self.img_firstpass()
-        self.draw_im_canvas(self.img_array)
+        #draw fresh image (decoded on the worker thread)
+        filepath = str(self.path_to_im.get())
+        self.submit_job(lambda: pixelengine.load_image(filepath),
+                        lambda img: self.show_fresh_image(filepath, img))
+    
+    def show_fresh_image(self,filepath,img):
+        
+        self.img_firstpass(filepath,img)
+        self.draw_im_canvas(self.canvas_data())
         
         #update popup text with new image shape and sharpness
         self.refresh_ranges()
     
-    #this function helps ensure that pixel cells are square- and not rectangular-shaped
-    def get_scaling_fraction(self):
-        
-        #fun fact -- these are not necessarily the height and width of the image!
-        self.height = np.shape(self.img_array)[0]
-        self.width = np.shape(self.img_array)[1]
-        
-        if (self.height>self.width) & ((self.width/self.height)<0.99):
-            fraction = self.width/self.height
-            return 1, fraction
-        elif (self.height<self.width) & ((self.height/self.width)<0.99):
-            fraction = self.height/self.width
-            return fraction, 1
-        elif (self.height==self.width) | ((self.width/self.height)>0.99) | ((self.height/self.width)>0.99):
-            return 1, 1
-        else:
-            print("I don't know what to tell ye. Your width and/or height are not numbers.")
-            return None
-    
-    def adjust_image(self,img):
-        
-        #if popup not initiated, then assign default values (1.) to sharp, contrast params
+    #if popup not initiated, then assign default values (1.) to sharp, contrast params
+    def get_adjust_params(self):
         try:
             sharp_param = float(self.popup_frame.sharp_slider.get())
             contrast_param = float(self.popup_frame.contrast_slider.get())
         except:
             sharp_param = 1.0
             contrast_param = 1.0
+        return sharp_param, contrast_param
+    
+    def get_threshold(self):
+        try:
+            return float(self.popup_frame.threshold_val.get())
+        except:
+            return 1.0
+    
+    #shape --> (height, width) to label the axes with, if img is a proxy for a larger image
+    def adjust_image(self,img,shape=None):
         
-        if sharp_param != 1.:
-            enhancer = ImageEnhance.Sharpness(img)
-            img = enhancer.enhance(sharp_param)
-        
-        if contrast_param != 1.:
-            enhancer = ImageEnhance.Contrast(img)
-            img = enhancer.enhance(contrast_param)
+        sharp_param, contrast_param = self.get_adjust_params()
+        img = pixelengine.adjust_image(img, sharp_param, contrast_param)
             
-        self.draw_im_canvas(np.asarray(img))
+        self.draw_im_canvas(pixelengine.image_data(img),shape)
         
         return img
     
-    def refresh_ranges(self,resized=False):
+    #display-sized version of self.img_only. kept until self.img_only changes (new image, trim, pixelate)
+    def get_proxy(self):
+        if self.proxy_source is not self.img_only:
+            max_side = int(max(self.fig.get_size_inches())*self.fig.dpi)
+            self.proxy = pixelengine.make_proxy(self.img_only, max_side)
+            self.proxy_source = self.img_only
+        return self.proxy
+    
+    #slider callbacks land here. a drag fires dozens of Scale ticks, so rather than running adjust_image
+    #on each one, (re)start a short timer and only adjust once the ticks pause -- or at least every
+    #max_wait seconds while the drag continues. adjust_image reads the sliders when it finally runs,
+    #so only the latest value is ever processed.
+    def schedule_adjust(self, delay_ms=60, max_wait=0.25):
+        now = time.monotonic()
+        if self.adjust_job is not None:
+            #an overdue update stays queued (it is about to run anyway)
+            if now - self.adjust_first >= max_wait:
+                return
+            self.after_cancel(self.adjust_job)
+        else:
+            self.adjust_first = now
+        self.adjust_job = self.after(delay_ms, self.run_adjust)
+    
+    #while sliding, only the display-sized proxy is adjusted (drawn over the full image's extent)
+    def run_adjust(self):
+        self.adjust_job = None
+        #the user may slide before loading an image
+        if hasattr(self, 'img_only'):
+            self.cancel_jobs()
+            self.result_img = None      #the canvas no longer shows the result as it is
+            self.adjust_image(self.get_proxy(), shape=(self.img_only.height, self.img_only.width))
+    
+    #slider released --> drop any pending preview and adjust the full-resolution image (on the worker)
+    def finish_adjust(self):
+        self.cancel_adjust()
+        if not hasattr(self, 'img_only'):
+            return
+        img = self.img_only
+        self.result_img = None
+        sharp_param, contrast_param = self.get_adjust_params()
+        self.submit_job(lambda: pixelengine.adjust_image(img, sharp_param, contrast_param),
+                        lambda img: self.draw_im_canvas(pixelengine.image_data(img)))
+    
+    def cancel_adjust(self):
+        if self.adjust_job is not None:
+            self.after_cancel(self.adjust_job)
+            self.adjust_job = None
+    
+    def refresh_ranges(self,resized=False,size=None):
         try:
-            width,height = self.img_only.size
+            width,height = self.img_only.size if size is None else size
             if not resized:
                 self.popup_frame.xrange_vals.delete(0,tk.END)
                 self.popup_frame.xrange_vals.insert(0,f'({0},{width})')
@@ -502,7 +771,11 @@ class MainPage(tk.Frame):
     #change range inputs in the tkinter textboxes from strings to integers
     def integerize_ranges(self,resize_version=False):
         
-        width,height = self.img_only.size
+        #the resize version works in the ORIGINAL image's coordinates
+        if resize_version:
+            width,height = self.width_og, self.height_og
+        else:
+            width,height = self.img_only.size
         
         xvals = self.popup_frame.xrange_vals.get()
         yvals = self.popup_frame.yrange_vals.get()
@@ -543,146 +816,157 @@ class MainPage(tk.Frame):
 
         return xmin, ymin_adj, xmax, ymax_adj
     
+    #(left, top, right, bottom) for the manual trim...origin is TOP LEFT OF IMAGE
+    def get_trim_box(self,resize_version=False):
+        
+        #the resize_version indicates whether I need to shift to the original coordinate system!
+        #(otherwise, the trimmed original image will isolate the incorrect areas)
+        try:
+            xmin, ymin_adj, xmax, ymax_adj = self.integerize_ranges(resize_version)
+        except:
+            print('Error reading coordinate ranges. Defaulting to original image dimensions.')
+            shape = (self.height_og, self.width_og) if resize_version else self.img_array.shape
+            xmin,xmax = 0, shape[0]
+            ymin_adj,ymax_adj = 0, shape[1]
+        
+        return (xmin, ymin_adj, xmax, ymax_adj)
+    
     def im_trim(self,mode,resize_version=False):
+        
+        #the slider-preview proxy belongs to the untrimmed image
+        self.proxy = None
+        self.proxy_source = None
                 
         if mode=='auto':
             self.auto=True
             self.manual=False
-            try:
-                #reshape image array to (number of pixels, number of channels)
-                pixels = self.img_array.reshape(-1, self.img_array.shape[2])
-
-                #find most common color -- ASSUMED to be background color!
-                unique_colors, counts = np.unique(pixels, axis=0, return_counts=True)
-                background_color = unique_colors[counts.argmax()]
-
-                #create new image with background color (I *think* it only contains that background color)
-                bg = Image.new(self.img_only.mode, self.img_only.size, tuple(background_color))
-
-            #if any steps beget errors, then claim the background color is the color of the upper left px
-            except:
-                bg = Image.new(self.img_only.mode, self.img_only.size, self.img_only.getpixel((0,0)))
-
-            #subtract background from image
-            diff = ImageChops.difference(self.img_only, bg)
-
-            #convert difference to grayscale...I guess.
-            diff = diff.convert('L')
-
-            #threshold difference image to create a binary image
-            #pixel values > threshold set to white (255), pixels < threshold set to black (0)
-            threshold = float(self.popup_frame.threshold_val.get())
-
-            diff = diff.point(lambda p: p > threshold and 255)
-
-            #get bounding box of non-background region
-            bbox = diff.getbbox()
-
-            if bbox:
-                self.img_only = self.img_only.crop(bbox)
-                self.img_array = np.asarray(self.img_only)
+            self.img_only = pixelengine.trim_auto(self.img_only, self.get_threshold())
+            self.set_img_array()
                         
         if mode=='manual':
             self.manual=True
             self.auto=False
-            
-            #the resize_version indicates whether I need to shift to the original coordinate system!
-            #(otherwise, the trimmed original image will isolate the incorrect areas)
-            try:
-                if resize_version:
-                    xmin, ymin_adj, xmax, ymax_adj = self.integerize_ranges(resize_version)
-                else:
-                    xmin, ymin_adj, xmax, ymax_adj = self.integerize_ranges()
-                    
-            except:
-                print('Error reading coordinate ranges. Defaulting to original image dimensions.')
-                xmin,xmax = 0, self.img_array.shape[0]
-                ymin_adj,ymax_adj = 0, self.img_array.shape[1]
-            
-            #(left, top, right, bottom)...origin is TOP LEFT OF IMAGE, so use transformed y-coordinates.
-            self.img_only = self.img_only.crop((xmin, ymin_adj, xmax, ymax_adj))
-            self.img_array = np.asarray(self.img_only)
+            self.img_only = pixelengine.trim_manual(self.img_only, self.get_trim_box(resize_version))
+            self.set_img_array()
         
         #update popup text with new image shape
         self.refresh_ranges()  
                 
+    #same as im_trim(mode='auto'), but the trim runs on the worker thread
     def im_trim_auto(self):
         
-        self.im_trim(mode='auto')
-        self.draw_im_canvas(self.img_array)
+        self.auto=True
+        self.manual=False
+        self.proxy = None
+        self.proxy_source = None
+        
+        img = self.img_only
+        threshold = self.get_threshold()
+        self.submit_job(lambda: pixelengine.trim_auto(img, threshold), self.show_trimmed)
+    
+    def show_trimmed(self,img):
+        
+        self.img_only = img
+        self.set_img_array()
+        self.refresh_ranges()
+        self.draw_im_canvas(self.canvas_data())
         
     def im_trim_manual(self):
         
+        self.cancel_jobs()
         self.im_trim(mode='manual')
-        self.draw_im_canvas(self.img_array)
+        self.draw_im_canvas(self.canvas_data())
     
-    #resizing the image and recreating the canvas.
-    def resize_im(self):
-        
-        self.img_firstpass()
+    #gather the pixelation parameters from the widgets into the engine's parameter object
+    def get_pixel_params(self):
         
+        trim_mode, trim_box = None, None
         if self.auto:
-            self.im_trim(mode='auto')
-            
+            trim_mode = 'auto'
         if self.manual:
-            self.im_trim(mode='manual',resize_version=True)
+            trim_mode = 'manual'
+            trim_box = self.get_trim_box(resize_version=True)
         
-        #if popup not initiated, set sharp, contrast params to default values (1.0)
+        #blank (or otherwise non-integer) N Colors textbox --> no quantization
         try:
-            sharp_value = float(self.popup_frame.sharp_slider.get())
-            contrast_value = float(self.popup_frame.contrast_slider.get())
+            ncolor = int(self.ncolor.get())
         except:
-            sharp_value = 1.0
-            contrast_value = 1.0
+            ncolor = None
         
-        self.img_only = self.adjust_image(self.img_only)
-        self.img_array = np.asarray(self.img_only)
+        sharp_value, contrast_value = self.get_adjust_params()
         
-        self.frac_h, self.frac_w = self.get_scaling_fraction() 
-        self.npixels = int(self.npx.get())
+        return pixelengine.PixelParams(npx=int(self.npx.get()), ncolor=ncolor,
+                                       sharpness=sharp_value, contrast=contrast_value,
+                                       trim_mode=trim_mode, trim_threshold=self.get_threshold(),
+                                       trim_box=trim_box, resample_mode=self.resample_mode.get())
+    
+    #read the file path and widgets (on the main thread) into the parameters a worker job needs
+    def prepare_params(self):
         
-        #resize "smoothly" down to desired number of pixels for x (nx*frac_w) and y (nx*frac_h)
-        #resample options: NEAREST, BILINEAR, BICUBIX, LANCZOS, BOX, HAMMING
-        self.img_only = self.img_only.resize((int(self.npixels*self.frac_w), 
-                                                int(self.npixels*self.frac_h)),
-                                               resample=Image.NEAREST)        
-        try:
-            #I assume users who select ncolor=2 are wanting a black/white BINARY image! 
-            if int(self.ncolor.get())==2:
-                self.img_only = self.img_only.convert('L')
-                
-                #the otsu threshold helps to automate the process of selecting which pixels are assigned 
-                #to white, and which to black.
-                otsu_threshold = threshold_otsu(np.asarray(self.img_only))
-                
-                #assign black if x>threshold and 0 if x<threshold, where x is the pixel value
-                self.img_only = self.img_only.point(lambda x: 255 if x>otsu_threshold else 0,mode='1')
-            else:
-                #otherwise, proceed as normal. :-)
-                ncol = int(self.ncolor.get())
-                
-                #first...separate the rgb and alpha channels
-                img_rgb = self.img_only.convert("RGB")  #extract RGB channels for quantization
-                img_alpha = self.img_only.getchannel("A") #preserve alpha channel
-                
-                #quantize accordingly!
-                self.img_only = img_rgb.quantize(colors=ncol)
-                #
-                self.img_only = self.img_only.convert("RGBA")
-                self.img_only.putalpha(img_alpha)
-                
-                #self.img_only = self.img_only.convert('RGBA')  #for the case where L is the image type
-        except:
-            self.img_only = self.img_only
+        self.full_filepath = str(self.path_to_im.get())
+        self.set_filename()
         
-        self.img_array = np.asarray(self.img_only)
-        self.draw_im_canvas(self.img_array)
+        #the manual trim box is given in the original image's coordinates (header read only)
+        self.width_og, self.height_og = pixelengine.image_size(self.full_filepath)
+        
+        return self.get_pixel_params()
+    
+    #resizing the image and recreating the canvas.
+    def resize_im(self):
+        
+        params = self.prepare_params()
+        filepath = self.full_filepath
+        pipeline = self.pipeline
+        
+        #only the stages downstream of a changed parameter are recomputed (on the worker thread)
+        def compute():
+            stages = dict(pipeline.run(filepath, params))
+            return stages, pipeline.keys['quantize']
+        
+        self.submit_job(compute, lambda result: self.show_pixelated(*result, params))
+    
+    def show_pixelated(self,stages,key,params):
+        
+        #update popup text with the trimmed image shape (the stages are arrays)
+        if params.trim_mode is not None:
+            self.refresh_ranges(size=stages['trim'].shape[1::-1])
+        
+        #quantized results stay in their compact form (index map + palette)
+        result = stages['quantize']
+        self.indexed = result if isinstance(result, pixelengine.IndexedImage) else None
+        self.img_array = result if self.indexed is None else result.index
+        self.img_only = pixelengine.result_image(result)
+        self.result_img = self.img_only
+        
+        #render stage -- skip the redraw if the canvas already shows this exact result
+        if self.rendered_key != key:
+            self.draw_im_canvas(self.canvas_data())
+            self.rendered_key = key
         
         #update RESIZED ranges in the popup tab, if applicable (i.e., if open)
         self.refresh_ranges(resized=True)
+        
+        self.after_idle(self.speculate, params, self.job_gen)
+    
+    #pixelate every (npx, ncolor) combination and hand the contact sheet (PIL image) to on_done.
+    #decode/trim/enhance come from (and stay in) the pipeline cache, shared with the Pixelate button.
+    def run_sweep(self,npx_values,ncolor_values,on_done):
+        
+        params = self.prepare_params()
+        filepath = self.full_filepath
+        pipeline = self.pipeline
+        
+        def compute():
+            enhanced = pipeline.run(filepath, params, until='enhance')['enhance']
+            results = pixelengine.sweep(enhanced, npx_values, ncolor_values,
+                                        resample_mode=params.resample_mode)
+            return pixelengine.contact_sheet(results, npx_values, ncolor_values)
+        
+        self.submit_job(compute, on_done)
 
     def flip_xaxis(self):
         
+        self.axes_dirty = True
         self.create_axislabels()
         offset = float(self.offset_val.get())
         
@@ -694,22 +978,18 @@ class MainPage(tk.Frame):
         self.ax.tick_params(labelsize=12)
         self.ax.set_xticks(self.xticks,labels=self.xlabels,fontsize=12)
         self.ax.set_yticks(self.yticks,labels=self.ylabels,fontsize=12)
-        self.canvas.draw()
+        self.canvas.draw_idle()
     
     def convert_grayscale(self):
         
         if self.grayvar.get():
-            self.im.remove()
-            
             img_only_gray = self.img_only.convert('L')
             img_array_gray = np.asarray(img_only_gray)
-            
-            self.im = self.ax.imshow(np.flipud(img_array_gray),origin='lower',cmap='gray')
-            self.canvas.draw()
+            self.set_canvas_data(img_array_gray)
         else:
-            self.im.remove()
-            self.im = self.ax.imshow(np.flipud(self.img_array),origin='lower')
-            self.canvas.draw()
+            self.set_canvas_data(self.canvas_data())
+        
+        self.canvas.draw_idle()
     
     def create_axislabels(self):
         
@@ -760,25 +1040,32 @@ class MainPage(tk.Frame):
             offset = float(self.offset_val.get())
             line_thickness = float(self.line_thickness.get())
             
-            self.xlines = []
-            self.ylines = []
-    
-            #set y gridlines
-            for n in range(0,np.shape(self.img_array)[0],line_spacing):
-                if (n+1)%10==0:
-                    line = self.ax.axhline(n+offset,lw=line_thickness+0.7,color=user_color,alpha=1)
-                else:
-                    line = self.ax.axhline(n+offset,lw=line_thickness,color=user_color,alpha=0.6)
-                self.xlines.append(line)
-
-            #set x gridlines
-            for n in range(0,np.shape(self.img_array)[1],line_spacing):
-                if (n+1)%10==0:
-                    line = self.ax.axvline(n+offset,lw=line_thickness+0.7,color=user_color,alpha=1)
-                else:
-                    line = self.ax.axvline(n+offset,lw=line_thickness,color=user_color,alpha=0.6)
-                self.ylines.append(line)    
+            height, width = np.shape(self.img_array)[:2]
+            
+            #one segment per gridline, y gridlines first. the segments run well past the image on either
+            #side (the axes clip them), so they stay full-length after flip_xaxis changes the limits.
+            ys = np.arange(0, height, line_spacing)
+            xs = np.arange(0, width, line_spacing)
+            lo, hi = -1-max(height,width), 2*max(height,width)
             
+            segments = np.empty((len(ys)+len(xs), 2, 2))
+            segments[:len(ys),:,0] = [lo, hi]
+            segments[:len(ys),:,1] = (ys+offset)[:,None]
+            segments[len(ys):,:,0] = (xs+offset)[:,None]
+            segments[len(ys):,:,1] = [lo, hi]
+            
+            #every 10th line is thicker and fully opaque
+            major = (np.concatenate([ys, xs])+1)%10==0
+            linewidths = np.where(major, line_thickness+0.7, line_thickness)
+            colors = np.tile(to_rgba(user_color), (len(major),1))
+            colors[~major,3] = 0.6
+            
+            #a single artist for the whole grid, rather than one axhline/axvline per row and column
+            self.remove_grid()
+            self.gridlines = LineCollection(segments, linewidths=linewidths, colors=colors, zorder=2)
+            self.ax.add_collection(self.gridlines, autolim=False)
+            
+            self.axes_dirty = True
             for spine in self.ax.spines.values():
                 spine.set_linewidth(line_thickness+0.7)
             
@@ -786,16 +1073,16 @@ class MainPage(tk.Frame):
             self.ax.set_xticks(self.xticks,labels=self.xlabels,fontsize=15)
             self.ax.set_yticks(self.yticks,labels=self.ylabels,fontsize=15)
             
-            self.canvas.draw()
+            self.canvas.draw_idle()
                 
         else:
-            for n in self.xlines:
-                n.remove()
-                #self.ax.xaxis.set_major_locator(ticker.AutoLocator())
-            for n in self.ylines:
-                n.remove()
-                #self.ax.yaxis.set_major_locator(ticker.AutoLocator())
-            self.canvas.draw()
+            self.remove_grid()
+            self.canvas.draw_idle()
+    
+    def remove_grid(self):
+        if self.gridlines is not None:
+            self.gridlines.remove()
+            self.gridlines = None
 
             
 class ParamWindow(tk.Toplevel):
@@ -890,8 +1177,10 @@ class ParamWindow(tk.Toplevel):
         sharplab.grid(row=1,column=0,columnspan=1,padx=5,pady=5)
         
         self.sharp_slider = tk.Scale(self.sharp_frame, from_=1, to=10, orient=tk.HORIZONTAL, resolution=0.1,
-                                length=250, command=lambda value: parent.adjust_image(parent.img_only))
+                                length=250, command=lambda value: parent.schedule_adjust())
         self.sharp_slider.grid(row=0,column=0,columnspan=1,padx=15)
+        self.sharp_slider.bind('<ButtonRelease-1>', lambda event: parent.finish_adjust())
+        self.sharp_slider.bind('<KeyRelease>', lambda event: parent.finish_adjust())
     
     def add_contrast_scroll(self,parent):
         
@@ -899,8 +1188,10 @@ class ParamWindow(tk.Toplevel):
         contrastlab.grid(row=1,column=1,pady=5,padx=5)
         
         self.contrast_slider = tk.Scale(self.sharp_frame, from_=1, to=10, orient=tk.HORIZONTAL, resolution=0.1,
-                                        length=250, command=lambda value: parent.adjust_image(parent.img_only))
+                                        length=250, command=lambda value: parent.schedule_adjust())
         self.contrast_slider.grid(row=0,column=1,columnspan=1,padx=15)
+        self.contrast_slider.bind('<ButtonRelease-1>', lambda event: parent.finish_adjust())
+        self.contrast_slider.bind('<KeyRelease>', lambda event: parent.finish_adjust())
             
     def add_spaceh(self,nrow):
         spacer1 = tk.Label(self,text=" ",padx=20)
@@ -910,11 +1201,163 @@ class ParamWindow(tk.Toplevel):
             
             
             
+class SweepWindow(tk.Toplevel):
+    
+    #sized by its contents (the contact sheet figure), unlike the Edit Display Image popup
+    def __init__(self, parent):
+        
+        super().__init__(parent)
+        
+        self.parent = parent
+        self.sheet = None
+        
+        self.title("Parameter Sweep")
+        
+        self.values_frame()
+        self.sheet_frame()
+        
+        self.add_value_widgets()
+        self.add_sheet_canvas()
+    
+    def values_frame(self):
+        self.values_frame=tk.LabelFrame(self,text='Sweep Values',font='Vendana 18',padx=15,pady=15)
+        self.values_frame.grid(column=0,row=0)
+    
+    def sheet_frame(self):
+        self.sheet_frame=tk.LabelFrame(self,text='Contact Sheet',font='Vendana 18',padx=5,pady=5)
+        self.sheet_frame.grid(column=0,row=1)
+    
+    def add_value_widgets(self):
+        
+        npx_lab = tk.Label(self.values_frame,text='N Pixels (comma-separated)',font='Arial 14')
+        npx_lab.grid(row=0,column=0,sticky='w')
+        self.npx_vals = tk.Entry(self.values_frame,width=15,borderwidth=2,bg='black',fg='lime green',
+                                 font='Arial 15')
+        self.npx_vals.insert(0,'30,40,50,60')
+        self.npx_vals.grid(row=0,column=1)
+        
+        ncolor_lab = tk.Label(self.values_frame,text='N Colors (blank = default)',font='Arial 14')
+        ncolor_lab.grid(row=1,column=0,sticky='w')
+        self.ncolor_vals = tk.Entry(self.values_frame,width=15,borderwidth=2,bg='black',fg='lime green',
+                                    font='Arial 15')
+        self.ncolor_vals.insert(0,'4,8,16')
+        self.ncolor_vals.grid(row=1,column=1)
+        
+        self.run_button = tk.Button(self.values_frame,text='Run Sweep',padx=2,pady=5,font='Arial 18',
+                                    command=self.run_sweep)
+        self.run_button.grid(row=2,column=0,sticky='ew')
+        
+        self.save_button = tk.Button(self.values_frame,text='Save Sheet',padx=2,pady=5,font='Arial 18',
+                                     command=self.save_sheet)
+        self.save_button.grid(row=2,column=1,sticky='ew')
+    
+    def add_sheet_canvas(self):
+        self.fig = figure.Figure(figsize=(6,6), layout="constrained")
+        self.ax = self.fig.add_subplot()
+        self.ax.axis('off')
+        self.canvas = FigureCanvasTkAgg(self.fig, master=self.sheet_frame)
+        self.canvas.get_tk_widget().grid(row=0,column=0)
+    
+    def run_sweep(self):
+        npx_values = [int(val) for val in self.npx_vals.get().split(',')]
+        #an empty entry (e.g., '4,,8') means no quantization, same as a blank N Colors textbox
+        ncolor_values = [int(val) if val.strip() else None for val in self.ncolor_vals.get().split(',')]
+        self.parent.run_sweep(npx_values, ncolor_values, self.show_sheet)
+    
+    def show_sheet(self, sheet):
+        #the popup may have been closed while the sweep was running
+        if not self.winfo_exists():
+            return
+        self.sheet = sheet
+        self.ax.clear()
+        self.ax.axis('off')
+        self.ax.imshow(np.asarray(sheet))
+        self.canvas.draw_idle()
+    
+    def save_sheet(self):
+        if self.sheet is None:
+            return
+        filename = pixelengine.filename_allocator.reserve(self.parent.save_path+self.parent.filename, '-sweep.png')
+        try:
+            pixelengine.save_png(self.sheet, filename, png_options)
+        except Exception:
+            pixelengine.filename_allocator.release(filename)
+            raise
+        print(f'Contact sheet saved to: {filename}')
+
+
+#run the pixelation on every image matching the --batch directory/glob, no GUI involved.
+#options are read from the command line in the same way as -params.
+def run_batch(argv, save_path):
+    
+    def get_arg(flag, default, kind):
+        if flag in argv:
+            return kind(argv[argv.index(flag)+1])
+        return default
+    
+    paths = pixelengine.find_images(argv[argv.index('--batch')+1])
+    
+    params = pixelengine.PixelParams(npx=get_arg('--npx', 50, int), ncolor=get_arg('--ncolor', None, int),
+                                     sharpness=get_arg('--sharpness', 1.0, float),
+                                     contrast=get_arg('--contrast', 1.0, float),
+                                     trim_mode='auto' if '--autotrim' in argv else None,
+                                     trim_threshold=get_arg('--threshold', 1.0, float),
+                                     resample_mode=get_arg('--resample', 'nearest', str))
+    workers = get_arg('--workers', None, int)
+    
+    if params.resample_mode not in pixelengine.RESAMPLE_MODES:
+        print(f'Unknown --resample mode {params.resample_mode}; choose from {pixelengine.RESAMPLE_MODES}')
+        return
+    
+    print(f'Pixelating {len(paths)} image(s) into {save_path}')
+    nfailed = 0
+    for path, result in pixelengine.batch_pixelate(paths, save_path, params, workers, png_options):
+        if isinstance(result, Exception):
+            nfailed += 1
+            print(f'FAILED: {path} ({result})')
+        else:
+            print(f'{path} --> {result}')
+    print(f'Done. {len(paths)-nfailed} saved, {nfailed} failed.')
+    
+
+
+#--profile-startup: draw the first window, time one build of the popup, print the phases and quit.
+#app.startup_ok is False if the time to the first window is over budget (seconds, if given)
+def profile_startup(app, budget=None):
+    
+    app.update()      #window mapped and the canvas drawn
+    mark_startup('first window drawn')
+    
+    page = app.frames[MainPage]
+    start = time.perf_counter()
+    page.popup_params()
+    page.popup_frame.update()
+    popup_time = time.perf_counter() - start
+    page.close_popup()
+    
+    print('Startup profile (seconds):')
+    for (_, previous), (phase, now) in zip(startup_marks, startup_marks[1:]):
+        print(f'  {phase:<34s}{now-previous:8.3f}')
+    total = startup_marks[-1][1] - startup_marks[0][1]
+    print(f'  {"TOTAL (launch to first window)":<34s}{total:8.3f}')
+    print(f'  {"Edit Display Image popup":<34s}{popup_time:8.3f}')
+    
+    app.startup_ok = budget is None or total <= budget
+    if budget is not None:
+        print(f'Budget: {budget:.3f} s --> {"OK" if app.startup_ok else "OVER BUDGET"}')
+    app.destroy()
+    
+            
 if __name__ == "__main__":
     
     #unpack params.txt file here
     if '-h' in sys.argv or '--help' in sys.argv:
-        print("USAGE: %s [-params (name of parameter.txt file, no single or double quotations marks)]")
+        print("USAGE: %s [-params (name of parameter.txt file, no single or double quotations marks)]" % sys.argv[0])
+        print("       %s -params params.txt --batch (directory or glob) [--npx 50] [--ncolor 8] [--workers N]" % sys.argv[0])
+        print("                [--sharpness 1.0] [--contrast 1.0] [--autotrim] [--threshold 1.0]")
+        print("                [--resample nearest|mean|median|dominant]")
+        print("       %s -params params.txt --profile-startup" % sys.argv[0])
+        sys.exit()
     
     if '-params' in sys.argv:
         p = sys.argv.index('-params')
@@ -939,6 +1382,20 @@ if __name__ == "__main__":
         init_offset = param_dict['init_offset']
         popup_geometry = param_dict['popup_geometry']
         
+        #optional -- older params.txt files will not have this line
+        if 'cache_mb' in param_dict:
+            pixelengine.image_cache.set_budget(float(param_dict['cache_mb'])*1024**2)
+        startup_budget = float(param_dict['startup_budget']) if 'startup_budget' in param_dict else None
+        png_options = pixelengine.PngOptions(int(param_dict.get('png_compress_level', 6)),
+                                             param_dict.get('png_optimize', 'False').lower()=='true')
+    mark_startup('read params file')
+        
+    if '--batch' in sys.argv:
+        run_batch(sys.argv, save_path)
+    else:
         app = App(path_to_repos, initial_browsedir, save_path, window_geometry, init_offset, popup_geometry)
+        if '--profile-startup' in sys.argv:
+            app.after_idle(profile_startup, app, startup_budget)
         app.mainloop()
-        
\ No newline at end of file
+        if not getattr(app, 'startup_ok', True):
+            sys.exit(1)